@@ -170,16 +170,16 @@ export const processWorkflow1 = async (req: Request, res: Response) => {
   try {
     // ============ AUTH CHECK ============
     const authTimer = new PerformanceTimer('auth_validation', traceId);
-    const authResult = validateRequest(req);
+    const authResult = await validateRequest(req);
     authTimer.end();
     
     if (authResult.error) {
-      logger.logAuthEvent(null, 'invalid_origin', {
+      logger.logAuthEvent(null, authResult.error === 'Unauthorized' ? 'failure' : 'invalid_origin', {
         traceId,
         origin: req.headers.origin,
       });
       
-      res.status(403).json({ error: authResult.error });
+      res.status(authResult.error === 'Unauthorized' ? 401 : 403).json({ error: authResult.error });
       return;
     }
 
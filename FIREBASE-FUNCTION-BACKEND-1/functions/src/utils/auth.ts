@@ -1,5 +1,7 @@
 import { Request } from 'express';
 import { v4 as uuidv4 } from 'uuid';
+import { initializeApp, getApps, getApp } from 'firebase-admin/app';
+import { getAuth } from 'firebase-admin/auth';
 import { logger } from '../utils/logger.js';
 
 // Allowed domains for CORS
@@ -35,9 +37,25 @@ const generateChatId = (): string => {
 };
 
 /**
- * Main auth function - validates request and returns user/chat IDs
+ * Resolve the caller's Firebase uid from an "Authorization: Bearer <ID token>" header.
+ * Returns null when no token is sent; throws when the token is invalid.
  */
-export const validateRequest = (req: Request) => {
+const verifyIdToken = async (req: Request): Promise<string | null> => {
+  const header = req.headers.authorization;
+  if (!header || !header.startsWith('Bearer ')) {
+    return null;
+  }
+  const app = getApps().length ? getApp() : initializeApp();
+  const decoded = await getAuth(app).verifyIdToken(header.slice('Bearer '.length));
+  return decoded.uid;
+};
+
+/**
+ * Main auth function - validates request and returns user/chat IDs.
+ * A verified Firebase uid becomes the userId, so the renderer can check
+ * ownership against the same ID token when it hands out video URLs.
+ */
+export const validateRequest = async (req: Request) => {
   // Check CORS
   const origin = req.headers.origin;
   if (!isAllowedOrigin(origin)) {
@@ -49,8 +67,20 @@ export const validateRequest = (req: Request) => {
     return { error: 'Forbidden' };
   }
 
-  // Generate user ID and get/create chat ID
-  const userId = generateUserId();
+  let uid: string | null;
+  try {
+    uid = await verifyIdToken(req);
+  } catch (error) {
+    logger.logWarning(
+      { operation: 'auth' },
+      'Rejected invalid ID token',
+      { origin, error: error instanceof Error ? error.message : String(error) }
+    );
+    return { error: 'Unauthorized' };
+  }
+
+  // Use the verified uid, or generate a user ID for callers without a token
+  const userId = uid || generateUserId();
   const chatId = req.body?.chatId || generateChatId();
 
   logger.logInfo(
@@ -6,6 +6,7 @@ import { motion } from "framer-motion";
 import { Send } from "lucide-react";
 import { validateTopic } from "../lib/validation/inputvalidation";
 import { useBackendIds } from "../lib/backendIdsContext";
+import { getIdToken } from "../lib/firebase";
 import { getQuickPromptVideo, quickPromptTexts } from "../lib/quickPromptVideos";
 
 interface ChatProps {
@@ -66,12 +67,14 @@ export const Chat = ({ onChatActivate }: ChatProps) => {
 
     // Regular backend flow
     try {
+      const idToken = await getIdToken();
       const response = await fetch(
         "https://us-central1-animation-padhaai-88646.cloudfunctions.net/processWorkflow1HTTP",
         {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
+            ...(idToken ? { Authorization: `Bearer ${idToken}` } : {}),
            },
           body: JSON.stringify({
             topic: message,
@@ -9,6 +9,7 @@ const DISABLED = process.env.NEXT_PUBLIC_FIREBASE_DISABLED === "true";
 
 // Default stubs
 let db: any = {};
+let auth: any = null;
 let hasFirebase = false;
 
 // Try to initialize real Firebase if available
@@ -18,6 +19,8 @@ if (!DISABLED) {
     const firebase = require("firebase/app");
     // eslint-disable-next-line @typescript-eslint/no-var-requires
     const { getFirestore } = require("firebase/firestore");
+    // eslint-disable-next-line @typescript-eslint/no-var-requires
+    const { getAuth } = require("firebase/auth");
 
     const firebaseConfig = {
       apiKey: process.env.NEXT_PUBLIC_FIREBASE_API_KEY,
@@ -30,6 +33,7 @@ if (!DISABLED) {
 
     const app = firebase.initializeApp(firebaseConfig);
     db = getFirestore(app);
+    auth = getAuth(app);
     hasFirebase = true;
   } catch {
     // firebase not installed or not configured
@@ -62,5 +66,17 @@ export function onSnapshot(docRef: any, cb: (snap: any) => void): Unsubscribe {
   return () => {};
 }
 
+// Firebase ID token for the current user, signing in anonymously if needed.
+// Backends use its uid as the owner of everything this browser creates.
+export async function getIdToken(): Promise<string | null> {
+  if (!hasFirebase || !auth) return null;
+
+  if (!auth.currentUser) {
+    const { signInAnonymously } = require("firebase/auth");
+    await signInAnonymously(auth);
+  }
+  return auth.currentUser.getIdToken();
+}
+
 // Export db last
 export { db };
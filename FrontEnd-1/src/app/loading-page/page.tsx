@@ -2,7 +2,7 @@
 
 import { useEffect } from "react";
 import { useRouter } from "next/navigation";
-import { doc, onSnapshot, db } from "../lib/firebase";
+import { doc, onSnapshot, db, getIdToken } from "../lib/firebase";
 import { useBackendIds } from "../lib/backendIdsContext";
 import LoadingCss from "../components/generating-video";
 
@@ -40,13 +40,32 @@ export default function LoadingPage() {
       const data = docSnap.data();
       console.log("Firestore document data:", data);
 
-      // Check for videoUrl (set by Backend 2 after rendering)
-      const videoUrl = data?.videoUrl;
+      // Backend 2 stores the blob path; the signed URL is fetched on demand
+      const videoPath = data?.videoPath;
       const renderStatus = data?.renderStatus;
 
-      if (videoUrl && renderStatus === 'completed') {
-        console.log("Video URL received from Backend 2:", videoUrl);
-        setSignedUrl(videoUrl);
+      if (videoPath && renderStatus === 'completed') {
+        console.log("Video path received from Backend 2:", videoPath);
+        getIdToken()
+          .then((idToken) =>
+            fetch(`${process.env.NEXT_PUBLIC_RENDERER_URL}/videos/${chatId}/url`, {
+              headers: idToken ? { Authorization: `Bearer ${idToken}` } : {},
+            })
+          )
+          .then((res) => {
+            if (!res.ok) throw new Error(`Signed URL request failed: ${res.status}`);
+            return res.json();
+          })
+          .then(({ url }) => {
+            setSignedUrl(url);
+            router.push("/download-page");
+          })
+          .catch((error) => {
+            console.error("Failed to fetch signed URL:", error);
+          });
+      } else if (data?.videoUrl && renderStatus === 'completed') {
+        // Documents written before Backend 2 stored blob paths carry the URL itself
+        setSignedUrl(data.videoUrl);
         router.push("/download-page");
       } else if (renderStatus === 'failed') {
         console.error("Render failed:", data?.renderMessage);
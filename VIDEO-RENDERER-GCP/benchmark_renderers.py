@@ -0,0 +1,98 @@
+# benchmark_renderers.py
+# ===============================
+# Compare Cairo and headless OpenGL render times on a scene corpus
+#
+# Usage: python benchmark_renderers.py <corpus_dir> [--scene MainScene] [--out results.json]
+# Every *.py file in corpus_dir is rendered once per backend.
+# ===============================
+import os
+import sys
+import json
+import time
+import glob
+import asyncio
+import argparse
+import logging
+import tempfile
+
+from services.manim_renderer import ManimRenderer
+from services.renderer_policy import CAIRO, OPENGL, analyze_scene, choose_renderer
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+async def render_once(backend: str, scene_name: str, manim_code: str) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"bench_{backend}_") as work_dir:
+        renderer = ManimRenderer(renderer=backend, work_dir=work_dir, fallback_to_cairo=False)
+        start = time.perf_counter()
+        try:
+            await renderer.render_video(None, scene_name, manim_code)
+            return {"ok": True, "seconds": round(time.perf_counter() - start, 2)}
+        except Exception as e:
+            return {"ok": False, "seconds": round(time.perf_counter() - start, 2), "error": str(e)[-300:]}
+
+async def run(corpus_dir: str, scene_name: str) -> list:
+    results = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.py"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            manim_code = f.read()
+
+        policy_choice, reason = choose_renderer(manim_code)
+        row = {
+            "scene": os.path.basename(path),
+            "features": analyze_scene(manim_code),
+            "policy": policy_choice,
+            "reason": reason,
+            CAIRO: await render_once(CAIRO, scene_name, manim_code),
+            OPENGL: await render_once(OPENGL, scene_name, manim_code),
+        }
+
+        # Fastest backend that actually produced a video
+        succeeded = [b for b in (CAIRO, OPENGL) if row[b]["ok"]]
+        row["fastest"] = min(succeeded, key=lambda b: row[b]["seconds"]) if succeeded else None
+        results.append(row)
+
+        print(
+            f"{row['scene']:<32} cairo {_fmt(row[CAIRO])}  opengl {_fmt(row[OPENGL])}  "
+            f"fastest={row['fastest']}  policy={policy_choice} ({reason})"
+        )
+    return results
+
+def _fmt(result: dict) -> str:
+    return f"{result['seconds']:>7.2f}s" if result["ok"] else "  FAILED"
+
+def summarize(results: list):
+    judged = [r for r in results if r["fastest"]]
+    if not judged:
+        print("No scene rendered successfully")
+        return
+
+    agree = sum(1 for r in judged if r["policy"] == r["fastest"])
+    total = {b: sum(r[b]["seconds"] for r in judged if r[b]["ok"]) for b in (CAIRO, OPENGL)}
+    policy_total = sum(
+        r[r["policy"]]["seconds"] if r[r["policy"]]["ok"] else r[CAIRO]["seconds"] + r[OPENGL]["seconds"]
+        for r in judged
+    )
+    opengl_failures = sum(1 for r in results if not r[OPENGL]["ok"] and r[CAIRO]["ok"])
+
+    print()
+    print(f"Scenes: {len(results)}  policy picked the fastest backend for {agree}/{len(judged)}")
+    print(f"Total seconds - cairo: {total[CAIRO]:.1f}  opengl: {total[OPENGL]:.1f}  policy: {policy_total:.1f}")
+    print(f"OpenGL-only failures (Cairo fallback needed): {opengl_failures}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Cairo and OpenGL render times")
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--scene", default="MainScene")
+    parser.add_argument("--out", help="Write per-scene results as JSON")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.corpus_dir):
+        sys.exit(f"Corpus directory not found: {args.corpus_dir}")
+
+    results = asyncio.run(run(args.corpus_dir, args.scene))
+    summarize(results)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
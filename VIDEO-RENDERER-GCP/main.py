@@ -1,21 +1,37 @@
 # main.py
 # ===============================
 # BACKEND 2 - NO RESPONSE PATTERN
-# Request stays open, container stays alive
+# Default: the /render request stays open while the job runs, so Cloud Run
+# keeps the container and its CPU alive.
+# WORKER_MODE: /render returns once the job is queued and rendering happens
+# with no request open - deploy with CPU always allocated and min-instances
+# (see README.Docker.md) or Cloud Run throttles the worker to a halt.
 # ===============================
 import os
+import socket
+import asyncio
 import logging
 import firebase_admin
-from firebase_admin import credentials
+from firebase_admin import credentials, auth
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
 from typing import Optional
 
 # Load environment variables and configure logging
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
+from services.log_pipeline import setup_logging, parse_sample_rates
+
+# JSON logs are queued on the event loop thread and written by a background thread
+log_pipeline = setup_logging(
+    level=logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper()),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+    sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES")),  # e.g. "DEBUG=0,INFO=0.25"
+    max_field_chars=int(os.getenv("LOG_MAX_FIELD_CHARS", 4000))
+)
 logger = logging.getLogger(__name__)
 
 # Initialize Firebase Admin SDK
@@ -38,18 +54,98 @@ from services.firestore_service import FirestoreService
 from services.manim_renderer import ManimRenderer
 from services.service_storage import StorageService
 from services.file_manager import FileManager
+from services.preview_generator import PreviewGenerator
+from services.checkpoint_store import CheckpointStore
+from services.job_queue import FirestoreJobQueue, LocalJobQueue
+from services.queue_worker import QueueWorker
 
 USE_VENV = os.getenv("USE_VENV", "false").lower() == "true"
 
 firestore_service = FirestoreService()
-manim_renderer = ManimRenderer(use_venv=USE_VENV)
-storage_service = StorageService()
+MANIM_RENDERER = os.getenv("MANIM_RENDERER", "cairo")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 1))
+
+# "auto" picks Cairo or headless OpenGL per scene; "cairo"/"opengl" force one.
+# Cairo stays the default until benchmark_renderers.py results on real scenes
+# back the policy's thresholds.
+# Each render worker gets its own work dir so renders never share media files.
+manim_renderers = [
+    ManimRenderer(
+        use_venv=USE_VENV,
+        renderer=MANIM_RENDERER,
+        work_dir=None if RENDER_WORKERS == 1 else os.path.join(os.getcwd(), "render_workers", f"worker_{i}")
+    )
+    for i in range(RENDER_WORKERS)
+]
+storage_service = StorageService(
+    url_ttl_seconds=int(os.getenv("SIGNED_URL_TTL_SECONDS", 7 * 24 * 3600)),
+    cache_max_entries=int(os.getenv("SIGNED_URL_CACHE_SIZE", 1024)),
+    cache_refresh_margin_seconds=int(os.getenv("SIGNED_URL_REFRESH_MARGIN_SECONDS", 3600))
+)
 file_manager = FileManager()
-webhook_handler = WebhookHandler(firestore_service, manim_renderer, storage_service, file_manager)
+POSTER_TIME = os.getenv("POSTER_TIME")
+preview_generator = PreviewGenerator(
+    poster_time=float(POSTER_TIME) if POSTER_TIME else None
+)
+# Checkpoints must live on storage every instance mounts (e.g. a GCS volume);
+# an instance's own /tmp is in-memory and gone with the instance
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR")
+checkpoint_store = None
+if CHECKPOINT_DIR:
+    checkpoint_store = CheckpointStore(
+        CHECKPOINT_DIR,
+        # Must outlast the longest render; Cloud Run requests time out at 60 min
+        claim_ttl_seconds=float(os.getenv("CHECKPOINT_CLAIM_TTL_SECONDS", 3600))
+    )
+else:
+    logger.warning("⚠️ CHECKPOINT_DIR is not set: renders interrupted by shutdown will be marked failed")
+INSTANCE_ID = os.getenv("K_REVISION", "local") + "/" + socket.gethostname()
+webhook_handler = WebhookHandler(
+    firestore_service, manim_renderers, storage_service, file_manager,
+    preview_generator, checkpoint_store,
+    stage_workers={
+        "fetch": int(os.getenv("FETCH_WORKERS", 2)),
+        "post_process": int(os.getenv("POST_PROCESS_WORKERS", 1)),
+        "upload": int(os.getenv("UPLOAD_WORKERS", 2)),
+        "finalize": int(os.getenv("FINALIZE_WORKERS", 2)),
+    },
+    stage_queue_size=int(os.getenv("STAGE_QUEUE_SIZE", 2)),
+    instance_id=INSTANCE_ID
+)
+
+# Worker mode: /render enqueues, and every instance pulls jobs from a shared queue
+WORKER_MODE = os.getenv("WORKER_MODE", "false").lower() == "true"
+job_queue = None
+queue_worker = None
+if WORKER_MODE:
+    if os.getenv("K_SERVICE"):
+        logger.warning(
+            "⚠️ WORKER_MODE renders outside requests: the Cloud Run service needs "
+            "--no-cpu-throttling and --min-instances >= 1"
+        )
+    if os.getenv("JOB_QUEUE", "firestore") == "local":
+        job_queue = LocalJobQueue(firestore_service=firestore_service)
+    else:
+        job_queue = FirestoreJobQueue(firestore_service=firestore_service)
+    queue_worker = QueueWorker(
+        job_queue, webhook_handler, INSTANCE_ID,
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", 120)),
+        heartbeat_interval=float(os.getenv("JOB_HEARTBEAT_SECONDS", 30)),
+        # One job past each render worker, so job N uploads while N+1 renders
+        max_in_flight=int(os.getenv("WORKER_MAX_IN_FLIGHT", RENDER_WORKERS + 1))
+    )
 
 # FastAPI app
 app = FastAPI()
 
+# The frontend fetches signed URLs directly from this service
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[o for o in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if o],
+    allow_methods=["GET"],
+    allow_headers=["*"],
+)
+
 class RenderRequest(BaseModel):
     userId: str
     chatId: str
@@ -62,9 +158,16 @@ async def render_video(request: RenderRequest):
     """
     logger.info(f"🎬 Received render request for userId: {request.userId}, chatId: {request.chatId}, traceId: {request.traceId}")
     
+    if webhook_handler.draining:
+        raise HTTPException(status_code=503, detail="Renderer is shutting down")
+    
+    if WORKER_MODE:
+        added = await job_queue.enqueue(request.userId, request.chatId, request.traceId)
+        return {"queued": added}
+    
     try:
         # Process the render - request stays open during this entire time
-        await webhook_handler.process_render_request(request.userId, request.chatId)
+        await webhook_handler.process_render_request(request.userId, request.chatId, request.traceId)
         
         logger.info(f"✅ Render completed successfully for userId: {request.userId}, chatId: {request.chatId}")
         
@@ -73,11 +176,112 @@ async def render_video(request: RenderRequest):
     
     # No return statement - FastAPI will return 200 OK with null body
 
+PREVIEW_ASSETS = ("video", "poster", "thumbnail", "sprite")
+
+async def verify_user(authorization: Optional[str]) -> str:
+    """
+    Return the uid from an "Authorization: Bearer <Firebase ID token>" header
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    
+    try:
+        # May fetch Google's signing certs, so keep it off the event loop
+        decoded = await asyncio.to_thread(auth.verify_id_token, authorization[len("Bearer "):])
+    except Exception as e:
+        logger.warning(f"Rejected ID token: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid ID token")
+    return decoded["uid"]
+
+@app.get("/videos/{chatId}/url")
+async def get_video_url(chatId: str, asset: str = "video", authorization: Optional[str] = Header(None)):
+    """
+    Sign a URL on demand for a rendered video or one of its previews.
+    Firestore stores only the blob path; URLs come from the signed-URL cache.
+    Only the document's owner, identified by their Firebase ID token, gets a URL.
+    """
+    if asset not in PREVIEW_ASSETS:
+        raise HTTPException(status_code=400, detail=f"asset must be one of {', '.join(PREVIEW_ASSETS)}")
+    
+    userId = await verify_user(authorization)
+    video_path = await firestore_service.get_video_path(userId, chatId, asset)
+    if not video_path:
+        raise HTTPException(status_code=404, detail=f"{asset.capitalize()} not found")
+    
+    try:
+        signed_url, expires_at = await storage_service.get_signed_url(video_path)
+    except Exception as e:
+        logger.error(f"❌ Failed to sign URL for chatId: {chatId}, error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Could not generate video URL")
+    
+    return {"chatId": chatId, "asset": asset, "url": signed_url, "expiresAt": int(expires_at)}
+
+@app.post("/resume")
+async def resume_render():
+    """
+    Pick up one render checkpointed by an instance that was shut down.
+    Call it from a scheduler (see README.Docker.md): like /render, the request
+    stays open for the whole render so Cloud Run keeps the CPU allocated.
+    In worker mode drained jobs go back on the queue instead.
+    """
+    if webhook_handler.draining:
+        raise HTTPException(status_code=503, detail="Renderer is shutting down")
+    
+    chat_id = await webhook_handler.resume_next()
+    return {"resumed": chat_id}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "backend-2"}
+    health = {
+        "status": "healthy",
+        "service": "backend-2",
+        "pipeline": webhook_handler.pipeline.stats(),
+        "logging": log_pipeline.stats()
+    }
+    if queue_worker:
+        health["worker"] = queue_worker.stats()
+    return health
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Pipeline stage and logging stats in Prometheus text format"""
+    return webhook_handler.pipeline.prometheus_metrics() + log_pipeline.prometheus_metrics()
+
+@app.on_event("startup")
+async def start_queue_worker():
+    if queue_worker:
+        app.state.queue_worker_task = asyncio.create_task(queue_worker.run())
+
+@app.on_event("shutdown")
+async def stop_queue_worker():
+    if queue_worker:
+        queue_worker.stop()
+        # Give a drained job time to hand its lease back
+        await queue_worker.wait_stopped(timeout=5)
+
+class DrainingServer(uvicorn.Server):
+    """
+    Checkpoint in-flight renders on SIGTERM before uvicorn starts its own
+    shutdown, which would otherwise wait on the open render request until
+    Cloud Run kills the container.
+    """
+    def handle_exit(self, sig, frame):
+        if webhook_handler.draining:
+            return super().handle_exit(sig, frame)
+        
+        logger.warning(f"Received signal {sig}, draining renders before shutdown")
+        self._drain_task = asyncio.get_event_loop().create_task(self._drain_then_exit(sig, frame))
+    
+    async def _drain_then_exit(self, sig, frame):
+        try:
+            await webhook_handler.drain()
+        except Exception as e:
+            logger.error(f"Error while draining: {str(e)}", exc_info=True)
+        super().handle_exit(sig, frame)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
+    # Pass the app object so the server shares this module's webhook_handler;
+    # log_config=None keeps uvicorn's loggers on the JSON pipeline set up above
+    DrainingServer(uvicorn.Config(app, host="0.0.0.0", port=port, log_config=None)).run()
\ No newline at end of file
@@ -0,0 +1,209 @@
+# ===============================
+# services/checkpoint_store.py
+# Durable checkpoints for renders interrupted by shutdown
+# ===============================
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Manim names uncached partial movie files by animation index
+SEGMENT_PATTERN = re.compile(r"uncached_(\d+)\.mp4$")
+
+class CheckpointStore:
+    def __init__(self, root_dir: str, claim_ttl_seconds: float = 3600.0):
+        """
+        root_dir can be a local directory or a mounted bucket
+        (e.g. a Cloud Run GCS volume) so other instances can resume.
+
+        Layout: {root_dir}/{chatId}/state.json
+                {root_dir}/{chatId}/segments/uncached_00000.mp4 ...
+                {root_dir}/{chatId}/claim   {"owner": ..., "claimedAt": ...}
+
+        A claim older than claim_ttl_seconds is treated as free, so a
+        checkpoint claimed by an instance that was killed outright is
+        resumed eventually. Keep it above the longest render.
+        """
+        self.root_dir = root_dir
+        self.claim_ttl_seconds = claim_ttl_seconds
+        os.makedirs(self.root_dir, exist_ok=True)
+        logger.info(f"Checkpoint store at: {self.root_dir}")
+
+    def _job_dir(self, chat_id: str) -> str:
+        return os.path.join(self.root_dir, chat_id)
+
+    def _claim_path(self, chat_id: str) -> str:
+        return os.path.join(self._job_dir(chat_id), "claim")
+
+    def _segments_dir(self, chat_id: str) -> str:
+        return os.path.join(self._job_dir(chat_id), "segments")
+
+    def save(self, chat_id: str, state: Dict[str, Any], segment_paths: List[str]) -> int:
+        """
+        Copy finished animation segments and write job state.
+        Only the contiguous run of segments from animation 0 is kept,
+        since that is what a resumed render can skip.
+        Returns the number of completed animations checkpointed.
+        """
+        segments_dir = self._segments_dir(chat_id)
+        os.makedirs(segments_dir, exist_ok=True)
+
+        for path in segment_paths:
+            target = os.path.join(segments_dir, os.path.basename(path))
+            if SEGMENT_PATTERN.search(path) and not os.path.exists(target):
+                # Copy under a temp name so a half-written file never looks complete
+                shutil.copyfile(path, target + ".tmp")
+                os.replace(target + ".tmp", target)
+
+        completed = len(self.segments(chat_id))
+        state = dict(state, completed_animations=completed, checkpointed_at=time.time())
+
+        state_path = os.path.join(self._job_dir(chat_id), "state.json")
+        with open(state_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+        logger.info(f"💾 Checkpointed {chat_id} with {completed} completed animations")
+        return completed
+
+    def segments(self, chat_id: str) -> List[str]:
+        """
+        Contiguous checkpointed segments starting at animation 0, in order
+        """
+        segments_dir = self._segments_dir(chat_id)
+        if not os.path.isdir(segments_dir):
+            return []
+
+        by_index = {}
+        for name in os.listdir(segments_dir):
+            match = SEGMENT_PATTERN.search(name)
+            if match:
+                by_index[int(match.group(1))] = os.path.join(segments_dir, name)
+
+        ordered = []
+        while len(ordered) in by_index:
+            ordered.append(by_index[len(ordered)])
+        return ordered
+
+    def load(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return saved state plus the segment paths, or None
+        """
+        state_path = os.path.join(self._job_dir(chat_id), "state.json")
+        if not os.path.exists(state_path):
+            return None
+
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.error(f"Unreadable checkpoint for {chat_id}: {str(e)}")
+            return None
+
+        state["segments"] = self.segments(chat_id)
+        return state
+
+    def list_resumable(self) -> List[str]:
+        """
+        Chat IDs with a checkpoint that no instance holds a live claim on
+        """
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root_dir)
+            if os.path.exists(os.path.join(self._job_dir(name), "state.json"))
+            and not self._live_claim(name)
+        )
+
+    def claim(self, chat_id: str, owner: str) -> bool:
+        """
+        Atomically claim a checkpoint so only one instance resumes it.
+        An expired claim is taken over.
+        """
+        claim_path = self._claim_path(chat_id)
+        for _ in range(2):
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileNotFoundError:
+                return False
+            except FileExistsError:
+                if not self._take_over_stale_claim(chat_id):
+                    return False
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"owner": owner, "claimedAt": time.time()}, f)
+            return True
+        return False
+
+    def release(self, chat_id: str, owner: str):
+        """
+        Drop our claim; a claim another instance took over after ours expired is left alone
+        """
+        claim = self._read_claim(chat_id)
+        if not claim or claim["owner"] != owner:
+            return
+        try:
+            os.remove(self._claim_path(chat_id))
+        except FileNotFoundError:
+            pass
+
+    def _read_claim(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        {"owner", "claimedAt", "raw"} for the current claim, or None
+        """
+        claim_path = self._claim_path(chat_id)
+        try:
+            with open(claim_path, 'r', encoding='utf-8') as f:
+                raw = f.read()
+            claimed_at = os.path.getmtime(claim_path)
+        except FileNotFoundError:
+            return None
+
+        try:
+            claim = json.loads(raw)
+        except ValueError:
+            # Plain owner string or a partially written claim: use the file's age
+            claim = {"owner": raw, "claimedAt": claimed_at}
+        return dict(claim, raw=raw)
+
+    def _live_claim(self, chat_id: str) -> bool:
+        claim = self._read_claim(chat_id)
+        return bool(claim) and time.time() - claim["claimedAt"] < self.claim_ttl_seconds
+
+    def _take_over_stale_claim(self, chat_id: str) -> bool:
+        """
+        Remove an expired claim. It is moved aside first and checked, so
+        two instances racing for it cannot both remove a fresh claim.
+        """
+        stale = self._read_claim(chat_id)
+        if not stale or time.time() - stale["claimedAt"] < self.claim_ttl_seconds:
+            return False
+
+        claim_path = self._claim_path(chat_id)
+        aside = f"{claim_path}.{uuid.uuid4().hex}"
+        try:
+            os.rename(claim_path, aside)
+        except FileNotFoundError:
+            return False
+
+        with open(aside, 'r', encoding='utf-8') as f:
+            moved = f.read()
+        if moved != stale["raw"]:
+            # Another instance replaced it in between; put their claim back
+            os.replace(aside, claim_path)
+            return False
+
+        os.remove(aside)
+        logger.warning(f"Taking over expired checkpoint claim on {chat_id} from {stale['owner']}")
+        return True
+
+    def delete(self, chat_id: str):
+        shutil.rmtree(self._job_dir(chat_id), ignore_errors=True)
+        logger.info(f"Removed checkpoint for {chat_id}")
@@ -3,7 +3,7 @@
 # UPDATED FOR DIRECT chatId USAGE (NO _workflow2 SUFFIX)
 # ===============================
 import logging
-from typing import Optional
+from typing import Optional, Dict, Any
 from firebase_admin import firestore
 from datetime import datetime
 
@@ -87,34 +87,127 @@ class FirestoreService:
         self, 
         userId: str,
         chatId: str, 
-        video_url: str
+        video_path: str,
+        previews: Optional[Dict[str, Any]] = None
     ):
         """
-        Mark render as complete with video URL
+        Mark render as complete with the storage blob path.
+        URLs are signed on demand, so only the path is persisted.
+        previews: optional {posterPath, thumbnailPath, spritePath, sprite, generationMs}
+        Idempotent: returns False without writing if the render is already complete
         """
         try:
             doc_ref = self.db.collection('finalAnswers').document(chatId)
             
-            # Verify document exists and belongs to user before updating
-            doc = doc_ref.get()
-            if not doc.exists:
-                logger.error(f"Cannot complete render: Document {chatId} not found")
-                return
+            # Read and write in one transaction so a second worker finishing
+            # the same job (e.g. after a lease was re-claimed) is a no-op
+            @firestore.transactional
+            def complete(transaction) -> bool:
+                doc = doc_ref.get(transaction=transaction)
+                if not doc.exists:
+                    logger.error(f"Cannot complete render: Document {chatId} not found")
+                    return False
+                    
+                data = doc.to_dict()
+                if data.get('ownerId') != userId:
+                    logger.error(f"Access denied: User {userId} cannot update document owned by {data.get('ownerId')}")
+                    return False
                 
-            data = doc.to_dict()
-            if data.get('ownerId') != userId:
-                logger.error(f"Access denied: User {userId} cannot update document owned by {data.get('ownerId')}")
-                return
+                if data.get('renderStatus') == 'completed' and data.get('videoPath'):
+                    logger.info(f"Render for chatId {chatId} already completed, keeping {data.get('videoPath')}")
+                    return False
+                
+                update = {
+                    'rendered': True,
+                    'videoPath': video_path,
+                    'renderStatus': 'completed',
+                    'renderedAt': datetime.utcnow(),
+                    'updatedAt': datetime.utcnow()
+                }
+                if previews:
+                    update['previews'] = previews
+                
+                transaction.update(doc_ref, update)
+                return True
             
-            doc_ref.update({
-                'rendered': True,
-                'videoUrl': video_url,
-                'renderStatus': 'completed',
-                'renderedAt': datetime.utcnow(),
-                'updatedAt': datetime.utcnow()
-            })
-            logger.info(f"Render completed for user {userId}, chatId: {chatId}")
+            applied = complete(self.db.transaction())
+            if applied:
+                logger.info(f"Render completed for user {userId}, chatId: {chatId}")
+            return applied
                     
         except Exception as e:
             logger.error(f"Error marking render complete for user {userId}, chatId {chatId}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    async def update_render_status_if_pending(
+        self,
+        userId: str,
+        chatId: str,
+        status: str,
+        message: str = ""
+    ) -> bool:
+        """
+        Like update_render_status, but never overwrites a completed render.
+        Checked in a transaction so a job that finishes concurrently (e.g.
+        during drain, or on another instance) keeps "completed".
+        Returns False without writing if the document is missing, owned by
+        someone else or already completed.
+        """
+        try:
+            doc_ref = self.db.collection('finalAnswers').document(chatId)
+            
+            @firestore.transactional
+            def update(transaction) -> bool:
+                doc = doc_ref.get(transaction=transaction)
+                if not doc.exists:
+                    logger.error(f"Cannot update status: Document {chatId} not found")
+                    return False
+                
+                data = doc.to_dict()
+                if data.get('ownerId') != userId:
+                    logger.error(f"Access denied: User {userId} cannot update document owned by {data.get('ownerId')}")
+                    return False
+                
+                if data.get('renderStatus') == 'completed':
+                    logger.info(f"Render for chatId {chatId} already completed, not setting {status}")
+                    return False
+                
+                transaction.update(doc_ref, {
+                    'renderStatus': status,
+                    'renderMessage': message,
+                    'updatedAt': datetime.utcnow()
+                })
+                return True
+            
+            updated = update(self.db.transaction())
+            if updated:
+                logger.info(f"Updated status to {status} for user {userId}, chatId: {chatId}")
+            return updated
+            
+        except Exception as e:
+            logger.error(f"Error updating render status for user {userId}, chatId {chatId}: {str(e)}")
+            raise
+
+    async def get_video_path(self, userId: str, chatId: str, asset: str = "video") -> Optional[str]:
+        """
+        Retrieve the stored blob path for a completed render.
+        asset: "video", or one of "poster", "thumbnail", "sprite"
+        """
+        try:
+            doc = self.db.collection('finalAnswers').document(chatId).get()
+            if not doc.exists:
+                logger.error(f"No document found for chatId: {chatId}")
+                return None
+            
+            data = doc.to_dict()
+            if data.get('ownerId') != userId:
+                logger.error(f"Access denied: User {userId} trying to access chatId {chatId} owned by {data.get('ownerId')}")
+                return None
+            
+            if asset == "video":
+                return data.get('videoPath')
+            return (data.get('previews') or {}).get(f"{asset}Path")
+            
+        except Exception as e:
+            logger.error(f"Error fetching video path for user {userId}, chatId {chatId}: {str(e)}")
+            raise
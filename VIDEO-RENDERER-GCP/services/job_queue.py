@@ -0,0 +1,285 @@
+# ===============================
+# services/job_queue.py
+# Shared render queue with lease-based claiming
+# ===============================
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+async def report_exhausted(firestore_service, jobs):
+    """
+    Mark finalAnswers failed for jobs that ran out of attempts, so the
+    frontend stops waiting on them
+    """
+    for job in jobs:
+        logger.error(f"Render job for chatId {job['chatId']} gave up after {job['attempts']} attempts")
+        if not firestore_service:
+            continue
+        try:
+            await firestore_service.update_render_status(
+                job['userId'], job['chatId'], "failed",
+                f"Render failed after {job['attempts']} attempts"
+            )
+        except Exception as e:
+            logger.error(f"Error marking chatId {job['chatId']} failed: {str(e)}")
+
+class FirestoreJobQueue:
+    """
+    Jobs live in renderJobs/{chatId}:
+        { userId, chatId, traceId, state, leaseOwner, availableAt, attempts }
+
+    availableAt is the time a job may next be claimed: the enqueue time for
+    queued jobs, the lease expiry for leased ones. It is removed once a job
+    is done or failed, so a single-field range query finds both fresh jobs
+    and expired leases without a composite index.
+    """
+    def __init__(
+        self,
+        collection: str = "renderJobs",
+        max_attempts: int = 3,
+        scan_limit: int = 5,
+        firestore_service=None
+    ):
+        """
+        firestore_service, if given, is told when a job runs out of attempts
+        """
+        self.db = firestore.client()
+        self.collection = self.db.collection(collection)
+        self.max_attempts = max_attempts
+        self.scan_limit = scan_limit
+        self.firestore_service = firestore_service
+
+    async def enqueue(self, userId: str, chatId: str, traceId: Optional[str] = None) -> bool:
+        """
+        Add a job. Re-enqueueing a chatId that is already queued or leased is a no-op.
+        """
+        return await asyncio.to_thread(self._enqueue_sync, userId, chatId, traceId)
+
+    def _enqueue_sync(self, userId, chatId, traceId) -> bool:
+        ref = self.collection.document(chatId)
+
+        @firestore.transactional
+        def txn(transaction):
+            snap = ref.get(transaction=transaction)
+            if snap.exists and snap.to_dict().get('state') in (QUEUED, LEASED):
+                return False
+            transaction.set(ref, {
+                'userId': userId,
+                'chatId': chatId,
+                'traceId': traceId,
+                'state': QUEUED,
+                'leaseOwner': None,
+                'availableAt': time.time(),
+                'attempts': 0,
+                'enqueuedAt': firestore.SERVER_TIMESTAMP
+            })
+            return True
+
+        added = txn(self.db.transaction())
+        if added:
+            logger.info(f"Enqueued render job for chatId: {chatId}")
+        return added
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Lease the oldest claimable job: queued, or leased by a worker whose
+        lease expired (a dead or stalled instance). Returns None when idle.
+        """
+        job, exhausted = await asyncio.to_thread(self._claim_sync, worker_id, lease_seconds)
+        await report_exhausted(self.firestore_service, exhausted)
+        return job
+
+    def _claim_sync(self, worker_id: str, lease_seconds: float):
+        """
+        Returns (leased job or None, jobs that ran out of attempts)
+        """
+        exhausted = []
+        now = time.time()
+        candidates = (
+            self.collection
+            .where('availableAt', '<=', now)
+            .order_by('availableAt')
+            .limit(self.scan_limit)
+            .stream()
+        )
+
+        for snap in candidates:
+            job, out_of_attempts = self._try_lease(snap.reference, worker_id, lease_seconds)
+            if out_of_attempts:
+                exhausted.append(job)
+            elif job:
+                return job, exhausted
+        return None, exhausted
+
+    def _try_lease(self, ref, worker_id: str, lease_seconds: float):
+        """
+        Returns (job, out_of_attempts). job is None when it could not be leased.
+        """
+        @firestore.transactional
+        def txn(transaction):
+            snap = ref.get(transaction=transaction)
+            if not snap.exists:
+                return None, False
+
+            job = snap.to_dict()
+            now = time.time()
+            # Another worker got here first, or the lease is still live
+            if job.get('state') not in (QUEUED, LEASED) or job.get('availableAt', now + 1) > now:
+                return None, False
+
+            if job.get('state') == LEASED:
+                logger.warning(f"Re-claiming expired lease on {job['chatId']} from {job.get('leaseOwner')}")
+
+            if job.get('attempts', 0) >= self.max_attempts:
+                transaction.update(ref, {
+                    'state': FAILED,
+                    'leaseOwner': None,
+                    'availableAt': firestore.DELETE_FIELD,
+                    'error': f"Gave up after {self.max_attempts} attempts"
+                })
+                return job, True
+
+            job.update(state=LEASED, leaseOwner=worker_id, attempts=job.get('attempts', 0) + 1)
+            transaction.update(ref, {
+                'state': LEASED,
+                'leaseOwner': worker_id,
+                'availableAt': now + lease_seconds,
+                'attempts': job['attempts']
+            })
+            return job, False
+
+        return txn(self.db.transaction())
+
+    async def heartbeat(self, chatId: str, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Extend our lease. False means the lease was lost to another worker.
+        """
+        return await asyncio.to_thread(
+            self._update_if_owner, chatId, worker_id,
+            {'availableAt': time.time() + lease_seconds}
+        )
+
+    async def complete(self, chatId: str, worker_id: str) -> bool:
+        return await asyncio.to_thread(
+            self._update_if_owner, chatId, worker_id,
+            {'state': DONE, 'leaseOwner': None, 'availableAt': firestore.DELETE_FIELD}
+        )
+
+    async def fail(self, chatId: str, worker_id: str, error: str) -> bool:
+        return await asyncio.to_thread(
+            self._update_if_owner, chatId, worker_id,
+            {'state': FAILED, 'leaseOwner': None, 'availableAt': firestore.DELETE_FIELD, 'error': error}
+        )
+
+    async def release(self, chatId: str, worker_id: str) -> bool:
+        """
+        Hand a job back to the queue immediately (e.g. checkpointed on shutdown)
+        """
+        return await asyncio.to_thread(
+            self._update_if_owner, chatId, worker_id,
+            {'state': QUEUED, 'leaseOwner': None, 'availableAt': time.time()}
+        )
+
+    def _update_if_owner(self, chatId: str, worker_id: str, fields: Dict[str, Any]) -> bool:
+        ref = self.collection.document(chatId)
+
+        @firestore.transactional
+        def txn(transaction):
+            snap = ref.get(transaction=transaction)
+            if not snap.exists:
+                return False
+            job = snap.to_dict()
+            if job.get('state') != LEASED or job.get('leaseOwner') != worker_id:
+                return False
+            transaction.update(ref, fields)
+            return True
+
+        return txn(self.db.transaction())
+
+
+class LocalJobQueue:
+    """
+    In-process stand-in with the same leasing semantics, for tests and
+    single-instance development. State is not shared across processes.
+    """
+    def __init__(self, max_attempts: int = 3, firestore_service=None):
+        self.max_attempts = max_attempts
+        self.firestore_service = firestore_service
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    async def enqueue(self, userId: str, chatId: str, traceId: Optional[str] = None) -> bool:
+        with self._lock:
+            existing = self.jobs.get(chatId)
+            if existing and existing['state'] in (QUEUED, LEASED):
+                return False
+            self.jobs[chatId] = {
+                'userId': userId,
+                'chatId': chatId,
+                'traceId': traceId,
+                'state': QUEUED,
+                'leaseOwner': None,
+                'availableAt': time.time(),
+                'attempts': 0
+            }
+            return True
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        job, exhausted = self._claim_sync(worker_id, lease_seconds)
+        await report_exhausted(self.firestore_service, exhausted)
+        return job
+
+    def _claim_sync(self, worker_id: str, lease_seconds: float):
+        exhausted = []
+        with self._lock:
+            now = time.time()
+            claimable = sorted(
+                (job for job in self.jobs.values()
+                 if job['state'] in (QUEUED, LEASED) and job['availableAt'] <= now),
+                key=lambda job: job['availableAt']
+            )
+            for job in claimable:
+                if job['attempts'] >= self.max_attempts:
+                    job.update(state=FAILED, leaseOwner=None, error=f"Gave up after {self.max_attempts} attempts")
+                    exhausted.append(dict(job))
+                    continue
+                job.update(
+                    state=LEASED,
+                    leaseOwner=worker_id,
+                    availableAt=now + lease_seconds,
+                    attempts=job['attempts'] + 1
+                )
+                return dict(job), exhausted
+            return None, exhausted
+
+    async def heartbeat(self, chatId: str, worker_id: str, lease_seconds: float) -> bool:
+        return self._update_if_owner(chatId, worker_id, availableAt=time.time() + lease_seconds)
+
+    async def complete(self, chatId: str, worker_id: str) -> bool:
+        return self._update_if_owner(chatId, worker_id, state=DONE, leaseOwner=None)
+
+    async def fail(self, chatId: str, worker_id: str, error: str) -> bool:
+        return self._update_if_owner(chatId, worker_id, state=FAILED, leaseOwner=None, error=error)
+
+    async def release(self, chatId: str, worker_id: str) -> bool:
+        return self._update_if_owner(chatId, worker_id, state=QUEUED, leaseOwner=None, availableAt=time.time())
+
+    def _update_if_owner(self, chatId: str, worker_id: str, **fields) -> bool:
+        with self._lock:
+            job = self.jobs.get(chatId)
+            if not job or job['state'] != LEASED or job['leaseOwner'] != worker_id:
+                return False
+            job.update(fields)
+            return True
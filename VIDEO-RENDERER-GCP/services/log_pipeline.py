@@ -0,0 +1,241 @@
+# ===============================
+# services/log_pipeline.py
+# Non-blocking JSON logging: records are queued on the calling thread
+# and formatted/written by a background listener thread
+# ===============================
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+# Job/trace fields attached to every record logged from the current task
+log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "log_context"}
+
+def set_log_context(**fields):
+    """
+    Replace the job fields for the current task (chatId, userId, traceId, stage)
+    """
+    log_context.set({key: value for key, value in fields.items() if value is not None})
+
+def cap_text(text: str, limit: int) -> str:
+    """
+    Keep the start and the end of long text; subprocess errors are at the end
+    """
+    if len(text) <= limit:
+        return text
+    head = limit // 4
+    tail = limit - head
+    return f"{text[:head]}...[{len(text) - limit} chars truncated]...{text[-tail:]}"
+
+
+class LogPipelineStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.emitted = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_emit(self, latency: float):
+        with self._lock:
+            self.emitted += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enqueued": self.enqueued,
+                "emitted": self.emitted,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "avg_latency_ms": round(self.latency_total / self.emitted * 1000, 3) if self.emitted else 0.0,
+                "max_latency_ms": round(self.latency_max * 1000, 3),
+            }
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: Dict[int, float], stats: LogPipelineStats):
+        """
+        rates: {levelno: fraction kept}. Levels not listed are always kept.
+        """
+        super().__init__()
+        self.rates = rates
+        self.stats = stats
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.stats.incr("sampled_out")
+        return False
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Does the minimum on the caller's thread: resolve the message, capture
+    the job context and enqueue. Drops (and counts) records when the queue
+    is full rather than blocking the event loop.
+    """
+    def __init__(self, log_queue: queue.Queue, stats: LogPipelineStats):
+        super().__init__(log_queue)
+        self.stats = stats
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks must be rendered before the frames change
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.log_context = log_context.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self.stats.incr("enqueued")
+        except queue.Full:
+            self.stats.incr("dropped")
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str, max_field_chars: int = 4000):
+        super().__init__()
+        self.service = service
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "service": self.service,
+            "msg": cap_text(record.getMessage(), self.max_field_chars),
+        }
+        entry.update(getattr(record, "log_context", None) or {})
+
+        # Fields passed via extra={...}, e.g. subprocess stderr/stdout
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = cap_text(value, self.max_field_chars) if isinstance(value, str) else value
+
+        if record.exc_text:
+            entry["exc"] = cap_text(record.exc_text, self.max_field_chars)
+
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class MeasuredStreamHandler(logging.StreamHandler):
+    """
+    Runs on the listener thread; records enqueue-to-write latency
+    """
+    def __init__(self, stream, stats: LogPipelineStats):
+        super().__init__(stream)
+        self.stats = stats
+
+    def emit(self, record: logging.LogRecord):
+        super().emit(record)
+        self.stats.record_emit(time.time() - record.created)
+
+
+class LogPipeline:
+    def __init__(self, listener: logging.handlers.QueueListener, log_queue: queue.Queue, stats: LogPipelineStats):
+        self.listener = listener
+        self.log_queue = log_queue
+        self._stats = stats
+        self._stopped = False
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats.snapshot(), queue_depth=self.log_queue.qsize())
+
+    def stop(self):
+        """
+        Flush queued records and stop the listener thread
+        """
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def prometheus_metrics(self) -> str:
+        stats = self.stats()
+        metrics = [
+            ("log_records_enqueued_total", "counter", "Log records queued for writing", stats["enqueued"]),
+            ("log_records_emitted_total", "counter", "Log records written", stats["emitted"]),
+            ("log_records_dropped_total", "counter", "Log records dropped because the queue was full", stats["dropped"]),
+            ("log_records_sampled_out_total", "counter", "Log records skipped by level sampling", stats["sampled_out"]),
+            ("log_queue_depth", "gauge", "Log records waiting to be written", stats["queue_depth"]),
+            ("log_emit_latency_avg_seconds", "gauge", "Average enqueue-to-write latency", stats["avg_latency_ms"] / 1000),
+            ("log_emit_latency_max_seconds", "gauge", "Maximum enqueue-to-write latency", stats["max_latency_ms"] / 1000),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[int, float]:
+    """
+    "DEBUG=0,INFO=0.25" -> {10: 0.0, 20: 0.25}
+    """
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        level, rate = part.split("=", 1)
+        levelno = logging.getLevelName(level.strip().upper())
+        if isinstance(levelno, int):
+            rates[levelno] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+def setup_logging(
+    level: int = logging.INFO,
+    service: str = "backend-2",
+    queue_size: int = 10000,
+    sample_rates: Optional[Dict[int, float]] = None,
+    max_field_chars: int = 4000
+) -> LogPipeline:
+    """
+    Route the root logger through a bounded queue to a JSON stdout writer
+    """
+    stats = LogPipelineStats()
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    queue_handler = AsyncQueueHandler(log_queue, stats)
+    # A handler filter (unlike a logger filter) also sees records propagated from child loggers
+    queue_handler.addFilter(SamplingFilter(sample_rates or {}, stats))
+
+    output_handler = MeasuredStreamHandler(sys.stdout, stats)
+    output_handler.setFormatter(JsonFormatter(service, max_field_chars))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output_handler)
+    listener.start()
+
+    pipeline = LogPipeline(listener, log_queue, stats)
+    atexit.register(pipeline.stop)
+    return pipeline
@@ -7,17 +7,35 @@ import logging
 import asyncio
 import glob
 import shutil
-from typing import Optional
+from typing import Optional, List
+from services.renderer_policy import CAIRO, OPENGL, AUTO, RENDERERS, choose_renderer
 
 logger = logging.getLogger(__name__)
 
+# Manim's traceback ends up in the job's renderMessage; keep its tail
+MAX_ERROR_CHARS = 2000
+
 class ManimRenderer:
-    def __init__(self, use_venv: bool = False, venv_name: str = "voiceover_env"):
+    def __init__(
+        self,
+        use_venv: bool = False,
+        venv_name: str = "voiceover_env",
+        renderer: str = CAIRO,  # "cairo", "opengl" or "auto" (per-scene policy)
+        work_dir: Optional[str] = None,
+        fallback_to_cairo: bool = True
+    ):
         self.use_venv = use_venv  # Option to use venv or not
         self.venv_name = venv_name
-        self.work_dir = os.getcwd()  # Current working directory
+        self.renderer = renderer.strip().lower()
+        if self.renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer '{renderer}', expected one of {', '.join(RENDERERS)}")
+        self.fallback_to_cairo = fallback_to_cairo
+        self.work_dir = work_dir or os.getcwd()  # Current working directory by default
         self.manim_file = os.path.join(self.work_dir, "manim_code.py")
         self.media_dir = os.path.join(self.work_dir, "media")
+        self._process = None  # In-flight Manim subprocess, for shutdown
+        self._terminated = False
+        self.last_backend = None  # Backend that produced the last video
         
         # Detect operating system for cross-platform compatibility
         self.is_windows = os.name == 'nt'
@@ -25,16 +43,20 @@ class ManimRenderer:
         
         logger.info(f"ManimRenderer initialized for {'Windows' if self.is_windows else 'Linux'}")
         logger.info(f"Virtual environment usage: {'Enabled' if self.use_venv else 'Disabled (Docker mode)'}")
+        logger.info(f"Renderer backend: {self.renderer}")
         
     async def render_video(
         self, 
         python_file_path: str,  # We'll ignore this and use our own file
         scene_name: str,
-        manim_code: str  # Add manim_code parameter
+        manim_code: str,  # Add manim_code parameter
+        start_animation: int = 0  # Skip animations already checkpointed
     ) -> str:
         """
         Cross-platform render: Works on both Windows and Linux
         For Docker deployment, use_venv should be False
+        When start_animation > 0 the video only covers animations from that index on
+        OpenGL renders that fail are retried once with Cairo
         """
         try:
             logger.info(f"Starting render process for scene: {scene_name} on {'Windows' if self.is_windows else 'Linux'}")
@@ -47,8 +69,21 @@ class ManimRenderer:
             self._create_manim_file(manim_code)
             
             # Step 2: Execute render command (platform-aware)
-            video_path = await self._execute_render_command(scene_name)
-            
+            self._terminated = False
+            backend = self._select_backend(manim_code)
+            try:
+                video_path = await self._execute_render_command(scene_name, start_animation, backend)
+            except Exception as e:
+                if backend != OPENGL or not self.fallback_to_cairo or self._terminated:
+                    raise
+                logger.warning(f"OpenGL render failed, falling back to Cairo: {str(e)}")
+                # Drop OpenGL partial movie files so they are not mixed with Cairo output
+                shutil.rmtree(self.media_dir, ignore_errors=True)
+                os.makedirs(self.media_dir, exist_ok=True)
+                backend = CAIRO
+                video_path = await self._execute_render_command(scene_name, start_animation, backend)
+            
+            self.last_backend = backend
             return video_path
             
         except Exception as e:
@@ -59,6 +94,32 @@ class ManimRenderer:
                 logger.info("Cleaned up manim_code.py (error case)")
             raise
     
+    def _select_backend(self, manim_code: str) -> str:
+        if self.renderer != AUTO:
+            return self.renderer
+        
+        backend, reason = choose_renderer(manim_code)
+        logger.info(f"Selected {backend} renderer ({reason})")
+        return backend
+    
+    def _backend_args(self, backend: str) -> List[str]:
+        if backend == OPENGL:
+            # Without a preview window OpenGL only produces a file with --write_to_movie
+            return ["--renderer=opengl", "--write_to_movie"]
+        return ["--renderer=cairo"]
+    
+    def _backend_env(self, backend: str) -> Optional[dict]:
+        """
+        OpenGL runs headless through Mesa's software rasterizer (llvmpipe),
+        using a surfaceless EGL context - no GPU or X server required
+        """
+        if backend != OPENGL:
+            return None
+        env = dict(os.environ)
+        env.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+        env.setdefault("EGL_PLATFORM", "surfaceless")
+        return env
+    
     def _create_manim_file(self, manim_code: str):
         """
         Create manim_code.py file in current directory
@@ -71,17 +132,17 @@ class ManimRenderer:
             logger.error(f"Error creating manim_code.py: {str(e)}")
             raise
     
-    async def _execute_render_command(self, scene_name: str) -> str:
+    async def _execute_render_command(self, scene_name: str, start_animation: int = 0, backend: str = CAIRO) -> str:
         """
         Execute render command - CROSS PLATFORM VERSION
         """
         try:
             if self.use_venv:
                 # Use virtual environment (for development)
-                video_path = await self._execute_with_venv(scene_name)
+                video_path = await self._execute_with_venv(scene_name, start_animation, backend)
             else:
                 # Direct execution (recommended for Docker)
-                video_path = await self._execute_direct(scene_name)
+                video_path = await self._execute_direct(scene_name, start_animation, backend)
             
             return video_path
             
@@ -89,7 +150,7 @@ class ManimRenderer:
             logger.error(f"Error executing render command: {str(e)}")
             raise
     
-    async def _execute_direct(self, scene_name: str) -> str:
+    async def _execute_direct(self, scene_name: str, start_animation: int = 0, backend: str = CAIRO) -> str:
         """
         Direct execution without virtual environment (Docker mode)
         """
@@ -102,8 +163,11 @@ class ManimRenderer:
                 "manim_code.py",
                 scene_name,
                 f"--media_dir={self.media_dir}",
-                "--disable_caching"
+                "--disable_caching",
+                *self._backend_args(backend)
             ]
+            if start_animation > 0:
+                cmd_args.append(f"--from_animation_number={start_animation}")
             
             logger.info(f"Command: {' '.join(cmd_args)}")
             logger.info(f"Media directory: {self.media_dir}")
@@ -113,22 +177,26 @@ class ManimRenderer:
                 *cmd_args,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                cwd=self.work_dir
+                cwd=self.work_dir,
+                env=self._backend_env(backend)
             )
+            self._process = process
             
             stdout, stderr = await process.communicate()
             
             if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Unknown Manim error"
-                stdout_msg = stdout.decode() if stdout else ""
-                logger.error(f"Manim command failed with return code {process.returncode}")
-                logger.error(f"STDERR: {error_msg}")
-                logger.error(f"STDOUT: {stdout_msg}")
-                raise Exception(f"Manim rendering failed: {error_msg}")
+                error_msg = stderr.decode(errors="replace") if stderr else "Unknown Manim error"
+                stdout_msg = stdout.decode(errors="replace") if stdout else ""
+                # One record; the log formatter caps the embedded output
+                logger.error(
+                    f"Manim command failed with return code {process.returncode}",
+                    extra={"stderr": error_msg, "stdout": stdout_msg}
+                )
+                raise Exception(f"Manim rendering failed: {error_msg[-MAX_ERROR_CHARS:]}")
             
             logger.info("Manim rendering completed successfully")
-            if stdout:
-                logger.debug(f"Manim output: {stdout.decode()}")
+            if stdout and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Manim output", extra={"stdout": stdout.decode(errors="replace")})
             
             # Find the generated video file
             video_path = self._find_generated_video(scene_name)
@@ -147,48 +215,56 @@ class ManimRenderer:
             logger.error(f"Error in direct execution: {str(e)}")
             raise
     
-    async def _execute_with_venv(self, scene_name: str) -> str:
+    async def _execute_with_venv(self, scene_name: str, start_animation: int = 0, backend: str = CAIRO) -> str:
         """
         Execute with virtual environment (development mode)
         """
         try:
             logger.info(f"Executing Manim with virtual environment: {self.venv_name}")
+            extra_args = " ".join(self._backend_args(backend))
+            if start_animation > 0:
+                extra_args += f" --from_animation_number={start_animation}"
             
             if self.is_windows:
                 # Windows PowerShell approach
-                shell_command = f"{self.venv_name}\\Scripts\\Activate.ps1; python -m manim manim_code.py {scene_name} --media_dir={self.media_dir} --disable_caching"
+                shell_command = f"{self.venv_name}\\Scripts\\Activate.ps1; python -m manim manim_code.py {scene_name} --media_dir={self.media_dir} --disable_caching {extra_args}"
                 process = await asyncio.create_subprocess_exec(
                     "powershell", "-Command", shell_command,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE,
-                    cwd=self.work_dir
+                    cwd=self.work_dir,
+                    env=self._backend_env(backend)
                 )
             else:
                 # Linux/Mac bash approach
-                shell_command = f"source {self.venv_name}/bin/activate && python -m manim manim_code.py {scene_name} --media_dir={self.media_dir} --disable_caching"
+                shell_command = f"source {self.venv_name}/bin/activate && python -m manim manim_code.py {scene_name} --media_dir={self.media_dir} --disable_caching {extra_args}"
                 process = await asyncio.create_subprocess_shell(
                     shell_command,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE,
-                    cwd=self.work_dir
+                    cwd=self.work_dir,
+                    env=self._backend_env(backend)
                 )
             
+            self._process = process
             logger.info(f"Command: {shell_command}")
             logger.info(f"Media directory: {self.media_dir}")
             
             stdout, stderr = await process.communicate()
             
             if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Unknown Manim error"
-                stdout_msg = stdout.decode() if stdout else ""
-                logger.error(f"Manim command failed with return code {process.returncode}")
-                logger.error(f"STDERR: {error_msg}")
-                logger.error(f"STDOUT: {stdout_msg}")
-                raise Exception(f"Manim rendering failed: {error_msg}")
+                error_msg = stderr.decode(errors="replace") if stderr else "Unknown Manim error"
+                stdout_msg = stdout.decode(errors="replace") if stdout else ""
+                # One record; the log formatter caps the embedded output
+                logger.error(
+                    f"Manim command failed with return code {process.returncode}",
+                    extra={"stderr": error_msg, "stdout": stdout_msg}
+                )
+                raise Exception(f"Manim rendering failed: {error_msg[-MAX_ERROR_CHARS:]}")
             
             logger.info("Manim rendering completed successfully")
-            if stdout:
-                logger.debug(f"Manim output: {stdout.decode()}")
+            if stdout and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Manim output", extra={"stdout": stdout.decode(errors="replace")})
             
             # Find the generated video file
             video_path = self._find_generated_video(scene_name)
@@ -272,6 +348,65 @@ class ManimRenderer:
             logger.error(f"Error finding generated video: {str(e)}")
             return None
     
+    def completed_segments(self) -> List[str]:
+        """
+        Partial movie files for animations that finished rendering.
+        While Manim is still running, the newest file may be half written,
+        so it is left out.
+        """
+        pattern = os.path.join(self.media_dir, "videos", "**", "partial_movie_files", "**", "*.mp4")
+        segments = sorted(glob.glob(pattern, recursive=True), key=os.path.basename)
+        
+        if segments and self._process and self._process.returncode is None:
+            segments = segments[:-1]
+        return segments
+    
+    async def terminate(self, timeout: float = 5.0):
+        """
+        Stop the in-flight Manim process (used when draining on shutdown)
+        """
+        process = self._process
+        if not process or process.returncode is not None:
+            return
+        
+        self._terminated = True
+        logger.warning("Terminating in-flight Manim render")
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+    
+    async def concat_videos(self, video_paths: List[str]) -> str:
+        """
+        Join checkpointed segments and a resumed render without re-encoding
+        """
+        list_file = os.path.join(self.media_dir, "concat.txt")
+        output_path = os.path.join(self.media_dir, "resumed.mp4")
+        
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for path in video_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-c", "copy", output_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.work_dir
+        )
+        _, stderr = await process.communicate()
+        
+        if process.returncode != 0:
+            raise Exception(f"Concatenating resumed video failed: {stderr.decode() if stderr else 'unknown error'}")
+        
+        logger.info(f"Joined {len(video_paths)} pieces into resumed video: {output_path}")
+        return output_path
+    
     def _cleanup_files(self):
         """
         Internal cleanup method - cross-platform
@@ -291,12 +426,18 @@ class ManimRenderer:
             logger.error(f"Error during cleanup: {str(e)}")
             # Don't raise exception for cleanup errors
 
-    def cleanup_after_upload(self):
+    def cleanup(self):
         """
-        Clean up manim_code.py and media directory AFTER video upload
-        Call this method manually after successful upload
+        Clean up manim_code.py and media directory once the rendered video
+        has been moved out of the work dir, so the renderer can take the next job
         """
         self._cleanup_files()
+
+    def cleanup_after_upload(self):
+        """
+        Older name for cleanup()
+        """
+        self.cleanup()
     
     async def test_environment(self) -> dict:
         """
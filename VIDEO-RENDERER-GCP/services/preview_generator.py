@@ -0,0 +1,136 @@
+# ===============================
+# services/preview_generator.py
+# Poster, thumbnail and seek-preview sprite from the finished mp4
+# ===============================
+import os
+import math
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+
+import av
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class PreviewGenerator:
+    def __init__(
+        self,
+        poster_time: Optional[float] = None,
+        thumbnail_width: int = 320,
+        sprite_tile_width: int = 160,
+        sprite_interval: float = 2.0,
+        sprite_columns: int = 10,
+        max_sprite_tiles: int = 100,
+        jpeg_quality: int = 80
+    ):
+        """
+        poster_time: seconds into the video for the poster frame.
+                     None uses the last frame (Manim scenes end on the result).
+        """
+        self.poster_time = poster_time
+        self.thumbnail_width = thumbnail_width
+        self.sprite_tile_width = sprite_tile_width
+        self.sprite_interval = sprite_interval
+        self.sprite_columns = sprite_columns
+        self.max_sprite_tiles = max_sprite_tiles
+        self.jpeg_quality = jpeg_quality
+
+    async def generate(self, video_path: str, output_dir: str) -> Dict[str, Any]:
+        """
+        Decode the video once in a worker thread and write
+        poster.jpg, thumbnail.jpg and sprite.jpg into output_dir
+        """
+        return await asyncio.to_thread(self._generate_sync, video_path, output_dir)
+
+    def _generate_sync(self, video_path: str, output_dir: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        os.makedirs(output_dir, exist_ok=True)
+
+        poster_frame = None
+        last_frame = None
+        tiles: List[Image.Image] = []
+        next_tile_time = 0.0
+
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.codec_context.thread_type = "AUTO"
+
+            # Widen the interval for long videos so the sprite stays bounded.
+            # Some muxers leave the stream duration unset; fall back to the container's.
+            if stream.duration:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration:
+                duration = container.duration / av.time_base
+            else:
+                duration = 0.0
+            interval = self.sprite_interval
+            if duration and duration / interval > self.max_sprite_tiles:
+                interval = duration / self.max_sprite_tiles
+
+            for frame in container.decode(stream):
+                t = float(frame.pts * stream.time_base) if frame.pts is not None else 0.0
+
+                # Only frames we keep are converted to RGB
+                if t >= next_tile_time and len(tiles) < self.max_sprite_tiles:
+                    tiles.append(self._resize(frame.to_image(), self.sprite_tile_width))
+                    next_tile_time += interval
+
+                if self.poster_time is not None and poster_frame is None and t >= self.poster_time:
+                    poster_frame = frame.to_image()
+
+                last_frame = frame
+
+        if last_frame is None:
+            raise Exception(f"No decodable frames in {video_path}")
+
+        poster = poster_frame if poster_frame is not None else last_frame.to_image()
+
+        poster_path = os.path.join(output_dir, "poster.jpg")
+        thumbnail_path = os.path.join(output_dir, "thumbnail.jpg")
+        sprite_path = os.path.join(output_dir, "sprite.jpg")
+
+        poster.save(poster_path, "JPEG", quality=self.jpeg_quality)
+        self._resize(poster, self.thumbnail_width).save(
+            thumbnail_path, "JPEG", quality=self.jpeg_quality
+        )
+        sprite_meta = self._write_sprite(tiles, sprite_path, interval)
+
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        logger.info(f"🖼️ Generated poster, thumbnail and {len(tiles)}-tile sprite in {elapsed_ms} ms")
+
+        return {
+            "poster": poster_path,
+            "thumbnail": thumbnail_path,
+            "sprite": sprite_path,
+            "sprite_meta": sprite_meta,
+            "elapsed_ms": elapsed_ms,
+        }
+
+    def _resize(self, image: Image.Image, width: int) -> Image.Image:
+        height = max(1, round(image.height * width / image.width))
+        return image.resize((width, height), Image.BILINEAR)
+
+    def _write_sprite(self, tiles: List[Image.Image], sprite_path: str, interval: float) -> Dict[str, Any]:
+        """
+        Lay tiles out row-major; the frontend maps seek time to
+        tile index = floor(t / interval)
+        """
+        tile_w, tile_h = tiles[0].size
+        columns = min(self.sprite_columns, len(tiles))
+        rows = math.ceil(len(tiles) / columns)
+
+        sheet = Image.new("RGB", (tile_w * columns, tile_h * rows))
+        for i, tile in enumerate(tiles):
+            sheet.paste(tile, ((i % columns) * tile_w, (i // columns) * tile_h))
+        sheet.save(sprite_path, "JPEG", quality=self.jpeg_quality)
+
+        return {
+            "columns": columns,
+            "rows": rows,
+            "tileWidth": tile_w,
+            "tileHeight": tile_h,
+            "interval": interval,
+            "count": len(tiles),
+        }
@@ -0,0 +1,155 @@
+# ===============================
+# services/queue_worker.py
+# Pull-based worker: claim jobs from the shared queue and render them
+# ===============================
+import time
+import random
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class QueueWorker:
+    def __init__(
+        self,
+        job_queue,
+        webhook_handler,
+        worker_id: str,
+        lease_seconds: float = 120.0,
+        heartbeat_interval: float = 30.0,
+        poll_interval: float = 2.0,
+        max_poll_interval: float = 15.0,
+        max_in_flight: int = 1
+    ):
+        """
+        Each instance holds at most max_in_flight leases - just enough to
+        keep its render pipeline busy - so no instance hoards a private
+        backlog: an idle instance always takes the oldest available job,
+        including jobs whose lease expired on a dead or stalled instance.
+        Throughput grows with the number of instances instead of with
+        request routing.
+        """
+        self.job_queue = job_queue
+        self.webhook_handler = webhook_handler
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = set()
+
+        self._stop_requested = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self.started_at = time.time()
+        self.busy_seconds = 0.0
+        self.counts = {"claimed": 0, "completed": 0, "failed": 0, "released": 0, "lease_lost": 0}
+
+    def stop(self):
+        self._stop_requested.set()
+
+    async def wait_stopped(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Queue worker did not stop in time; its lease will expire and be re-claimed")
+
+    def stats(self) -> dict:
+        uptime = max(time.time() - self.started_at, 1e-9)
+        return {
+            "worker_id": self.worker_id,
+            "in_flight": len(self._in_flight),
+            "utilization": round(self.busy_seconds / (uptime * self.max_in_flight), 3),
+            **self.counts,
+        }
+
+    async def run(self):
+        logger.info(f"🛠️ Queue worker {self.worker_id} started")
+        idle_delay = self.poll_interval
+
+        try:
+            while not self._stop_requested.is_set() and not self.webhook_handler.draining:
+                # Only claim when the pipeline has room for another job
+                await self._slots.acquire()
+                if self._stop_requested.is_set() or self.webhook_handler.draining:
+                    # Stopped while waiting for a slot; leave the job for another instance
+                    self._slots.release()
+                    break
+                try:
+                    job = await self.job_queue.claim(self.worker_id, self.lease_seconds)
+                except Exception as e:
+                    logger.error(f"Error claiming job: {str(e)}")
+                    job = None
+
+                if not job:
+                    self._slots.release()
+                    # Back off while idle; jitter keeps instances from polling in lockstep
+                    try:
+                        await asyncio.wait_for(
+                            self._stop_requested.wait(),
+                            timeout=idle_delay * random.uniform(0.5, 1.5)
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    idle_delay = min(idle_delay * 2, self.max_poll_interval)
+                    continue
+
+                idle_delay = self.poll_interval
+                task = asyncio.create_task(self._process(job))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+            # Let claimed jobs finish (or be released after a drain)
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+        finally:
+            self._stopped.set()
+            logger.info(f"Queue worker {self.worker_id} stopped")
+
+    async def _process(self, job: dict):
+        chatId = job["chatId"]
+        self.counts["claimed"] += 1
+        logger.info(f"Claimed chatId: {chatId} (attempt {job.get('attempts')})")
+
+        heartbeat = asyncio.create_task(self._heartbeat(chatId))
+        start = time.time()
+        try:
+            status = await self.webhook_handler.process_render_request(
+                job["userId"], chatId, job.get("traceId"), from_queue=True
+            )
+        finally:
+            heartbeat.cancel()
+            self.busy_seconds += time.time() - start
+            self._slots.release()
+
+        try:
+            # "skipped": finished earlier, e.g. by a previous attempt
+            if status in ("completed", "skipped"):
+                await self.job_queue.complete(chatId, self.worker_id)
+                self.counts["completed"] += 1
+            elif status == "cancelled":
+                # The lease already belongs to another worker
+                pass
+            elif status == "resumable":
+                await self.job_queue.release(chatId, self.worker_id)
+                self.counts["released"] += 1
+            else:
+                await self.job_queue.fail(chatId, self.worker_id, "Render failed")
+                self.counts["failed"] += 1
+        except Exception as e:
+            # The lease will expire and the job will be re-claimed
+            logger.error(f"Error updating queue state for chatId {chatId}: {str(e)}")
+
+    async def _heartbeat(self, chatId: str):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.job_queue.heartbeat(chatId, self.worker_id, self.lease_seconds):
+                    # Another worker took over; stop instead of rendering and uploading a duplicate
+                    logger.warning(f"Lost lease on chatId: {chatId}, cancelling")
+                    self.counts["lease_lost"] += 1
+                    await self.webhook_handler.cancel(chatId)
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat failed for chatId {chatId}: {str(e)}")
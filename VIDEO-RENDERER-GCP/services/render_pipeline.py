@@ -0,0 +1,165 @@
+# ===============================
+# services/render_pipeline.py
+# Staged job pipeline with bounded queues between stages
+# ===============================
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from services.log_pipeline import set_log_context
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    """Raised in place of the next stage once job["cancelled"] is set"""
+
+
+class PipelineStage:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        workers: int = 1,
+        queue_size: int = 2
+    ):
+        """
+        handler(job) does this stage's work. queue_size bounds the jobs
+        waiting in front of the stage; when it is full the upstream worker
+        blocks, which is how a slow stage pushes back on earlier ones.
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.processed = 0
+        self.failed = 0
+
+
+class RenderPipeline:
+    def __init__(
+        self,
+        stages: List[PipelineStage],
+        on_error: Callable[[Dict[str, Any], Exception], Awaitable[Any]]
+    ):
+        """
+        Jobs flow through stages in order. The last stage's return value
+        resolves the job; an exception in any stage resolves it with
+        on_error(job, exc) instead. A job with job["cancelled"] set skips
+        its remaining stages and resolves through on_error with JobCancelled.
+        """
+        self.stages = stages
+        self.on_error = on_error
+        self._tasks: List[asyncio.Task] = []
+        self.started_at = None
+
+    def start(self):
+        if self._tasks:
+            return
+        self.started_at = time.time()
+        for index, stage in enumerate(self.stages):
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+            for n in range(stage.workers):
+                self._tasks.append(asyncio.create_task(
+                    self._worker(index, stage), name=f"pipeline-{stage.name}-{n}"
+                ))
+        logger.info("Render pipeline started: " + ", ".join(f"{s.name} x{s.workers}" for s in self.stages))
+
+    async def submit(self, job: Dict[str, Any]) -> Any:
+        """
+        Enqueue a job (waiting while the first stage is full) and
+        wait for it to leave the pipeline
+        """
+        self.start()
+        job["future"] = asyncio.get_running_loop().create_future()
+        await self.stages[0].queue.put(job)
+        return await job["future"]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, index: int, stage: PipelineStage):
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            job = await stage.queue.get()
+            job["stage"] = stage.name
+            set_log_context(
+                chatId=job.get("chatId"), userId=job.get("userId"),
+                traceId=job.get("traceId"), stage=stage.name
+            )
+            if job.get("cancelled"):
+                stage.queue.task_done()
+                await self._resolve_error(job, JobCancelled(f"Cancelled before {stage.name}"))
+                continue
+
+            stage.busy += 1
+            start = time.perf_counter()
+            try:
+                result = await stage.handler(job)
+            except Exception as e:
+                stage.failed += 1
+                await self._resolve_error(job, e)
+                continue
+            finally:
+                stage.busy -= 1
+                stage.busy_seconds += time.perf_counter() - start
+                stage.queue.task_done()
+
+            stage.processed += 1
+            if next_stage:
+                # Blocks while the next stage is saturated (backpressure)
+                await next_stage.queue.put(job)
+            elif not job["future"].done():
+                job["future"].set_result(result)
+
+    async def _resolve_error(self, job: Dict[str, Any], error: Exception):
+        try:
+            result = await self.on_error(job, error)
+        except Exception as handler_error:
+            logger.error(f"Error handler failed: {str(handler_error)}")
+            result = None
+        if not job["future"].done():
+            job["future"].set_result(result)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        uptime = max(time.time() - self.started_at, 1e-9) if self.started_at else None
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "busy_workers": stage.busy,
+                "queue_depth": stage.queue.qsize() if stage.queue else 0,
+                "queue_capacity": stage.queue_size,
+                "utilization": round(stage.busy_seconds / (uptime * stage.workers), 3) if uptime else 0.0,
+                "processed": stage.processed,
+                "failed": stage.failed,
+            }
+            for stage in self.stages
+        }
+
+    def prometheus_metrics(self) -> str:
+        """
+        Stage stats in Prometheus text exposition format
+        """
+        metrics = [
+            ("render_pipeline_queue_depth", "gauge", "Jobs waiting in front of the stage", "queue_depth"),
+            ("render_pipeline_queue_capacity", "gauge", "Bound on jobs waiting in front of the stage", "queue_capacity"),
+            ("render_pipeline_busy_workers", "gauge", "Stage workers currently processing a job", "busy_workers"),
+            ("render_pipeline_stage_utilization", "gauge", "Fraction of stage worker time spent busy", "utilization"),
+            ("render_pipeline_jobs_processed_total", "counter", "Jobs that completed the stage", "processed"),
+            ("render_pipeline_jobs_failed_total", "counter", "Jobs that failed in the stage", "failed"),
+        ]
+        stats = self.stats()
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, values in stats.items():
+                lines.append(f'{name}{{stage="{stage}"}} {values[key]}')
+        return "\n".join(lines) + "\n"
@@ -1,88 +1,404 @@
 # services/webhook_handler.py
 # ===============================
 # UPDATED FOR HTTP WITH userId/chatId CONSISTENCY
+# Jobs run through a staged pipeline:
+# fetch -> render -> post_process -> upload -> finalize
 # ===============================
+import os
+import socket
+import shutil
 import logging
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List
+
+from services.render_pipeline import PipelineStage, RenderPipeline
+from services.log_pipeline import set_log_context
 
 logger = logging.getLogger(__name__)
 
+class RenderInterrupted(Exception):
+    """Raised when a job reaches fetch/render after draining started"""
+
+class RenderSkipped(Exception):
+    """Raised when the render is already completed (or its document is gone)"""
+
 class WebhookHandler:
-    def __init__(self, firestore_service, manim_renderer, storage_service, file_manager):
+    def __init__(
+        self,
+        firestore_service,
+        manim_renderer,
+        storage_service,
+        file_manager,
+        preview_generator=None,
+        checkpoint_store=None,
+        stage_workers: Optional[Dict[str, int]] = None,
+        stage_queue_size: int = 2,
+        instance_id: Optional[str] = None
+    ):
+        """
+        manim_renderer may be a single ManimRenderer or a list of them, each
+        with its own work_dir; the render stage runs one worker per renderer.
+        stage_workers sets worker counts for the other stages.
+        instance_id identifies this instance when claiming checkpoints.
+        """
         self.firestore_service = firestore_service
-        self.manim_renderer = manim_renderer
+        self.renderers: List = manim_renderer if isinstance(manim_renderer, list) else [manim_renderer]
         self.storage_service = storage_service
-        # Note: file_manager is not used anymore but keeping for compatibility
+        self.preview_generator = preview_generator
+        self.checkpoint_store = checkpoint_store
+        self.instance_id = instance_id or socket.gethostname()
+        # file_manager provides the temp directory rendered videos are staged in
         self.file_manager = file_manager
-    
+        self.staging_dir = os.path.join(file_manager.get_temp_directory(), "render_jobs")
+
+        # Shutdown state: jobs in flight, keyed by chatId
+        self.draining = False
+        self.active_jobs: Dict[str, Dict[str, Any]] = {}
+
+        # Idle renderers; a render worker holds one for the duration of a render
+        self._idle_renderers: Optional[asyncio.Queue] = None
+
+        workers = {"fetch": 2, "post_process": 1, "upload": 2, "finalize": 2}
+        workers.update(stage_workers or {})
+        self.pipeline = RenderPipeline(
+            [
+                PipelineStage("fetch", self._stage_fetch, workers["fetch"], stage_queue_size),
+                PipelineStage("render", self._stage_render, len(self.renderers), stage_queue_size),
+                PipelineStage("post_process", self._stage_post_process, workers["post_process"], stage_queue_size),
+                PipelineStage("upload", self._stage_upload, workers["upload"], stage_queue_size),
+                PipelineStage("finalize", self._stage_finalize, workers["finalize"], stage_queue_size),
+            ],
+            on_error=self._on_job_error
+        )
+
     async def process_render_request(
         self,
         userId: str,
         chatId: str,
-    ):
+        traceId: Optional[str] = None,
+        checkpoint_claimed: bool = False,
+        from_queue: bool = False
+    ) -> Optional[str]:
         """
         Process the render request asynchronously with userId and chatId
         Updated to work with HTTP request structure from Backend-1
+        Resumes from a checkpoint when a previous instance was shut down mid-render
+        Waits while the pipeline is full, then until the job leaves it.
+        checkpoint_claimed: the caller already holds this chatId's checkpoint claim
+        from_queue: the caller re-queues the job if shutdown stops it before it starts
+        Returns "completed", "skipped", "resumable", "cancelled" or "failed"
         """
+        job = {
+            "userId": userId, "chatId": chatId, "traceId": traceId,
+            "stage": "queued", "claimed": checkpoint_claimed, "from_queue": from_queue
+        }
+        self.active_jobs[chatId] = job
+        set_log_context(chatId=chatId, userId=userId, traceId=traceId)
+
         try:
             logger.info(f"Starting render process for userId: {userId}, chatId: {chatId}")
-                        
-            # Update Firestore with processing status
-            await self.firestore_service.update_render_status(
-                userId, chatId, "processing", "Starting video render"
-            )
-                        
-            # Step 1: Fetch Manim code from Firestore using userId and chatId
+            return await self.pipeline.submit(job)
+        finally:
+            self.active_jobs.pop(chatId, None)
+            # Only give up a claim we hold; another instance may own it
+            if self.checkpoint_store and job["claimed"]:
+                self.checkpoint_store.release(chatId, self.instance_id)
+
+    async def _stage_fetch(self, job: Dict[str, Any]):
+        userId, chatId = job["userId"], job["chatId"]
+        if self.draining:
+            raise RenderInterrupted("Renderer is shutting down")
+
+        # Update Firestore with processing status; a render that already
+        # completed (e.g. a stale checkpoint) is not started again
+        started = await self.firestore_service.update_render_status_if_pending(
+            userId, chatId, "processing", "Starting video render"
+        )
+        if not started:
+            raise RenderSkipped(f"Render for chatId {chatId} is already completed or unavailable")
+
+        # Step 1: Fetch Manim code from Firestore using userId and chatId
+        checkpoint = self._claim_checkpoint(job)
+        segments = []
+
+        if checkpoint and checkpoint.get("manim_code"):
+            manim_code = checkpoint["manim_code"]
+            # Voiceover audio is muxed when Manim combines partials, so
+            # segment-level resume would drop narration - start over instead
+            if "VoiceoverScene" not in manim_code:
+                segments = checkpoint["segments"]
+            logger.info(f"Resuming chatId: {chatId} from animation {len(segments)}")
+        else:
             logger.info(f"Fetching Manim code for userId: {userId}, chatId: {chatId}")
             manim_code = await self.firestore_service.get_manim_code(userId, chatId)
-                        
-            if not manim_code:
-                raise Exception("No Manim code found in Firestore")
-            
-            # Debug logging to verify what we're getting
-            logger.info(f"User ID: {userId}")
-            logger.info(f"Chat ID: {chatId}")
-            logger.info(f"Manim code preview: {manim_code[:100]}...")
-                        
+
+        if not manim_code:
+            raise Exception("No Manim code found in Firestore")
+
+        # IDs are already on every record via the log context
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Manim code preview: {manim_code[:100]}...")
+
+        job.update(manim_code=manim_code, segments=segments)
+
+    async def _stage_render(self, job: Dict[str, Any]):
+        userId, chatId = job["userId"], job["chatId"]
+        if self.draining:
+            raise RenderInterrupted("Renderer is shutting down")
+
+        if self._idle_renderers is None:
+            self._idle_renderers = asyncio.Queue()
+            for renderer in self.renderers:
+                self._idle_renderers.put_nowait(renderer)
+
+        renderer = await self._idle_renderers.get()
+        job["renderer"] = renderer
+        try:
             # Step 2: Render video using existing approach
             # Since scene name is ignored, we'll pass a default scene name
             # The actual scene name will be determined from the Manim code itself
             logger.info(f"Rendering video for userId: {userId}, chatId: {chatId}")
-            
-            video_path = await self.manim_renderer.render_video(
+            video_path = await renderer.render_video(
                 None,           # python_file_path not used in new approach
                 "MainScene",    # default scene name - will be ignored as per your request
-                manim_code      # the actual manim code
+                job["manim_code"],
+                start_animation=len(job["segments"])
+            )
+
+            if job["segments"]:
+                video_path = await renderer.concat_videos(job["segments"] + [video_path])
+
+            logger.info(f"Rendered with {renderer.last_backend} backend for chatId: {chatId}")
+
+            # Move the video out of the renderer's work dir so it can take the next job
+            job_dir = os.path.join(self.staging_dir, chatId)
+            os.makedirs(job_dir, exist_ok=True)
+            job["video_path"] = os.path.join(job_dir, "video.mp4")
+            shutil.move(video_path, job["video_path"])
+        finally:
+            renderer.cleanup()
+            job.pop("renderer", None)
+            self._idle_renderers.put_nowait(renderer)
+
+    async def _stage_post_process(self, job: Dict[str, Any]):
+        """
+        Poster, thumbnail and sprite from the finished mp4. A failure here
+        never fails the render.
+        """
+        job["previews"] = None
+        if not self.preview_generator:
+            return
+
+        try:
+            output_dir = os.path.join(os.path.dirname(job["video_path"]), "previews")
+            job["previews"] = await self.preview_generator.generate(job["video_path"], output_dir)
+            logger.info(f"Preview generation added {job['previews']['elapsed_ms']} ms to the job")
+        except Exception as e:
+            logger.warning(f"Preview generation failed, continuing without previews: {str(e)}")
+
+    async def _stage_upload(self, job: Dict[str, Any]):
+        userId, chatId = job["userId"], job["chatId"]
+
+        # Step 3: Upload to Firebase Storage
+        logger.info(f"Uploading video to storage for userId: {userId}, chatId: {chatId}")
+        job["video_blob_path"] = await self.storage_service.upload_video(
+            job["video_path"], f"{userId}_{chatId}"  # Use combined identifier for unique filename
+        )
+
+        previews = job.get("previews")
+        job["preview_fields"] = None
+        if previews:
+            try:
+                blob_paths = await self.storage_service.upload_previews(previews, job["video_blob_path"])
+                job["preview_fields"] = {
+                    'posterPath': blob_paths.get('poster'),
+                    'thumbnailPath': blob_paths.get('thumbnail'),
+                    'spritePath': blob_paths.get('sprite'),
+                    'sprite': previews['sprite_meta'],
+                    'generationMs': previews['elapsed_ms'],
+                }
+            except Exception as e:
+                logger.warning(f"Preview upload failed, continuing without previews: {str(e)}")
+
+    async def _stage_finalize(self, job: Dict[str, Any]) -> str:
+        userId, chatId = job["userId"], job["chatId"]
+
+        # Step 4: Update Firestore with success
+        await self.firestore_service.update_render_complete(
+            userId, chatId, job["video_blob_path"], job["preview_fields"]
+        )
+
+        # Delete the checkpoint we resumed from or wrote while draining; an
+        # unclaimed one belongs to whoever is resuming it
+        if self.checkpoint_store and (job["claimed"] or job.get("checkpointed")):
+            self.checkpoint_store.delete(chatId)
+
+        # Step 5: Now cleanup files AFTER successful upload
+        self._cleanup_staging(chatId)
+
+        logger.info(f"Render completed successfully for userId: {userId}, chatId: {chatId}")
+        return "completed"
+
+    async def _on_job_error(self, job: Dict[str, Any], error: Exception) -> str:
+        userId, chatId = job["userId"], job["chatId"]
+
+        # Cleanup files even on error
+        self._cleanup_staging(chatId)
+
+        if job.get("cancelled"):
+            # Whoever took the job over owns its Firestore status; just drop
+            # anything this attempt already uploaded
+            previews = job.get("preview_fields") or {}
+            uploaded = [job.get("video_blob_path")] + [previews.get(key) for key in ("posterPath", "thumbnailPath", "spritePath")]
+            await self.storage_service.delete_blobs([path for path in uploaded if path])
+            logger.warning(f"Render cancelled for chatId {chatId}")
+            return "cancelled"
+
+        if isinstance(error, RenderSkipped):
+            logger.info(f"Skipping render for chatId {chatId}: already completed or unavailable")
+            if self.checkpoint_store and job["claimed"]:
+                self.checkpoint_store.delete(chatId)
+            return "skipped"
+
+        if job.get("checkpointed"):
+            # Interrupted by shutdown - another instance will resume it
+            logger.info(f"Render interrupted for shutdown, chatId {chatId} is resumable")
+            return "resumable"
+
+        if isinstance(error, RenderInterrupted):
+            # Never started, so nothing to checkpoint
+            logger.info(f"Shutdown before chatId {chatId} started rendering")
+            if job["from_queue"]:
+                # The queue worker hands the job back and another instance renders it
+                await self.firestore_service.update_render_status_if_pending(
+                    userId, chatId, "queued", "Renderer restarting, job re-queued"
+                )
+                return "resumable"
+            # A direct /render caller has to send the job again
+            await self.firestore_service.update_render_status_if_pending(
+                userId, chatId, "failed", "Renderer shut down before the job started, please retry"
             )
-                                
-            # Step 3: Upload to Firebase Storage
-            logger.info(f"Uploading video to storage for userId: {userId}, chatId: {chatId}")
-            video_url = await self.storage_service.upload_video(
-                video_path, f"{userId}_{chatId}"  # Use combined identifier for unique filename
+            return "failed"
+
+        # A resumed job that fails for real must not be offered for resume again
+        if self.checkpoint_store and job["claimed"]:
+            self.checkpoint_store.delete(chatId)
+
+        logger.error(f"Render failed for userId {userId}, chatId {chatId} in {job['stage']} stage: {str(error)}")
+        await self.firestore_service.update_render_status_if_pending(
+            userId, chatId, "failed", str(error)
+        )
+        return "failed"
+
+    def _cleanup_staging(self, chatId: str):
+        try:
+            shutil.rmtree(os.path.join(self.staging_dir, chatId), ignore_errors=True)
+        except Exception as cleanup_error:
+            logger.error(f"Error during cleanup: {str(cleanup_error)}")
+
+    def _claim_checkpoint(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Claim and load this chatId's checkpoint. Returns None - render from
+        scratch - when there is none or another instance is resuming it.
+        """
+        userId, chatId = job["userId"], job["chatId"]
+        if not self.checkpoint_store or not self.checkpoint_store.load(chatId):
+            return None
+
+        if not job["claimed"]:
+            if not self.checkpoint_store.claim(chatId, self.instance_id):
+                logger.warning(f"Checkpoint for chatId {chatId} is claimed elsewhere, rendering from scratch")
+                return None
+            job["claimed"] = True
+
+        # Re-read under the claim; it may have been deleted in between
+        checkpoint = self.checkpoint_store.load(chatId)
+        if checkpoint and checkpoint.get("userId") != userId:
+            logger.error(f"Access denied: checkpoint for chatId {chatId} belongs to another user")
+            return None
+        return checkpoint
+
+    async def resume_next(self) -> Optional[str]:
+        """
+        Claim one resumable checkpoint and render it to completion.
+        Returns the chatId that was resumed, or None if nothing was waiting.
+        """
+        if not self.checkpoint_store or self.draining:
+            return None
+
+        for chatId in self.checkpoint_store.list_resumable():
+            if not self.checkpoint_store.claim(chatId, self.instance_id):
+                continue
+
+            checkpoint = self.checkpoint_store.load(chatId)
+            if not checkpoint:
+                self.checkpoint_store.release(chatId, self.instance_id)
+                continue
+
+            logger.info(f"Claimed checkpoint for chatId: {chatId}")
+            await self.process_render_request(checkpoint["userId"], chatId, checkpoint_claimed=True)
+            return chatId
+
+        return None
+
+    async def cancel(self, chatId: str):
+        """
+        Abandon an in-flight job, e.g. when its queue lease was lost to
+        another instance. It skips its remaining stages; a running render
+        is stopped.
+        """
+        job = self.active_jobs.get(chatId)
+        if not job:
+            return
+
+        job["cancelled"] = True
+        renderer = job.get("renderer")
+        if renderer:
+            await renderer.terminate()
+
+    async def drain(self):
+        """
+        Stop accepting work, checkpoint in-flight jobs and stop Manim.
+        Called on SIGTERM before the server shuts down.
+        """
+        self.draining = True
+        logger.warning(f"Draining {len(self.active_jobs)} in-flight job(s) for shutdown")
+
+        for job in list(self.active_jobs.values()):
+            await self._checkpoint_job(job)
+
+        for renderer in self.renderers:
+            await renderer.terminate()
+
+    async def _checkpoint_job(self, job: Dict[str, Any]):
+        userId, chatId = job["userId"], job["chatId"]
+        # Jobs past render are expected to finish before the hard kill, and
+        # queued jobs have nothing to save; only fetch/render are checkpointed
+        if not self.checkpoint_store or job["stage"] not in ("fetch", "render"):
+            return
+
+        try:
+            renderer = job.get("renderer")
+            segments = renderer.completed_segments() if job["stage"] == "render" and renderer else []
+            completed = await asyncio.to_thread(
+                self.checkpoint_store.save,
+                chatId,
+                {"userId": userId, "chatId": chatId, "manim_code": job.get("manim_code")},
+                segments
             )
-            
-            # Step 4: Now cleanup files AFTER successful upload
-            logger.info("Video uploaded successfully, cleaning up files...")
-            self.manim_renderer.cleanup_after_upload()
-                                
-            # Step 5: Update Firestore with success
-            await self.firestore_service.update_render_complete(
-                userId, chatId, video_url
+            # Hold the claim while the job may still finish here; it is
+            # released (and the checkpoint offered for resume) when the job ends
+            if not job["claimed"]:
+                job["claimed"] = self.checkpoint_store.claim(chatId, self.instance_id)
+
+            marked = await self.firestore_service.update_render_status_if_pending(
+                userId, chatId, "resumable",
+                f"Interrupted by shutdown after {completed} animation(s)"
             )
-                                
-            logger.info(f"Render completed successfully for userId: {userId}, chatId: {chatId}")
-                        
+            if not marked:
+                # Already completed - the checkpoint is not needed
+                self.checkpoint_store.delete(chatId)
+                return
+            job["checkpointed"] = True
         except Exception as e:
-            logger.error(f"Render failed for userId {userId}, chatId {chatId}: {str(e)}")
-            
-            # Cleanup files even on error
-            try:
-                self.manim_renderer.cleanup_after_upload()
-                logger.info("Cleaned up files after error")
-            except Exception as cleanup_error:
-                logger.error(f"Error during cleanup: {str(cleanup_error)}")
-            
-            await self.firestore_service.update_render_status(
-                userId, chatId, "failed", str(e)
-            )
\ No newline at end of file
+            logger.error(f"Failed to checkpoint chatId {chatId}: {str(e)}")
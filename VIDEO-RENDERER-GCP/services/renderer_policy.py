@@ -0,0 +1,100 @@
+# ===============================
+# services/renderer_policy.py
+# Pick Cairo or headless OpenGL per scene from its source
+# ===============================
+import re
+import ast
+import logging
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+CAIRO = "cairo"
+OPENGL = "opengl"
+AUTO = "auto"  # Decide per scene with choose_renderer
+RENDERERS = (CAIRO, OPENGL, AUTO)
+
+# 3D scenes are where Cairo's CPU path is slowest
+THREE_D_PATTERN = re.compile(
+    r"\b(ThreeDScene|ThreeDAxes|Surface|Sphere|Cube|Prism|Cone|Cylinder|Torus|"
+    r"Dot3D|Line3D|Arrow3D|set_camera_orientation|move_camera)\b"
+)
+
+# Features the OpenGL renderer does not support (or supports differently)
+OPENGL_INCOMPATIBLE_PATTERN = re.compile(
+    r"\b(MovingCameraScene|ZoomedScene|VoiceoverScene|ImageMobject|camera\.frame)\b"
+)
+
+def analyze_scene(manim_code: str) -> Dict[str, Any]:
+    """
+    Static features of a scene: 3D usage, OpenGL blockers and an estimate
+    of how many mobjects it creates (constructor calls, multiplied by
+    literal range() loop counts around them).
+    """
+    incompatible = sorted(set(OPENGL_INCOMPATIBLE_PATTERN.findall(manim_code)))
+    return {
+        "three_d": bool(THREE_D_PATTERN.search(manim_code)),
+        "opengl_incompatible": incompatible,
+        "object_estimate": _estimate_objects(manim_code),
+    }
+
+def choose_renderer(manim_code: str, object_threshold: int = 150) -> Tuple[str, str]:
+    """
+    Return (renderer, reason)
+    """
+    features = analyze_scene(manim_code)
+
+    if features["opengl_incompatible"]:
+        return CAIRO, f"uses {', '.join(features['opengl_incompatible'])}"
+    if features["three_d"]:
+        return OPENGL, "3D scene"
+    if features["object_estimate"] >= object_threshold:
+        return OPENGL, f"~{features['object_estimate']} mobjects"
+    return CAIRO, "simple 2D scene"
+
+def _estimate_objects(manim_code: str) -> int:
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError:
+        # Let Manim report the error; just count capitalised calls
+        return len(re.findall(r"\b[A-Z]\w*\(", manim_code))
+
+    total = 0
+
+    def visit(node, multiplier):
+        nonlocal total
+        if isinstance(node, ast.For):
+            multiplier *= _literal_range_length(node.iter)
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            for generator in node.generators:
+                multiplier *= _literal_range_length(generator.iter)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", "")
+            if name[:1].isupper():
+                total += multiplier
+
+        for child in ast.iter_child_nodes(node):
+            visit(child, multiplier)
+
+    visit(tree, 1)
+    return total
+
+def _literal_range_length(node) -> int:
+    """
+    len(range(...)) when the arguments are int literals, else a guess of 1
+    """
+    if not (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "range"):
+        return 1
+
+    args = []
+    for arg in node.args:
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, int):
+            args.append(arg.value)
+        else:
+            return 1
+
+    try:
+        return max(len(range(*args)), 1)
+    except (TypeError, ValueError):
+        return 1
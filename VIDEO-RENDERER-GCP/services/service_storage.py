@@ -1,43 +1,39 @@
 # ===============================
 # services/storage_service.py
-# FIXED VERSION - With service account for signed URLs
+# Stores blob paths, signs URLs on demand with an LRU/TTL cache
 # ===============================
 import os
+import time
+import asyncio
 import logging
 from datetime import datetime, timedelta
+from typing import Tuple
 from firebase_admin import storage
-from google.cloud import storage as gcs
-from google.oauth2 import service_account
+from services.signed_url_cache import SignedUrlCache
 
 logger = logging.getLogger(__name__)
 
 class StorageService:
-    def __init__(self):
+    def __init__(
+        self,
+        url_ttl_seconds: int = 7 * 24 * 3600,
+        cache_max_entries: int = 1024,
+        cache_refresh_margin_seconds: int = 3600
+    ):
+        # The Firebase Admin bucket carries the app's service account
+        # credentials, so it can sign URLs without a second GCS client
         self.bucket = storage.bucket()
         self.bucket_name = self.bucket.name
-        
-        # Load service account credentials for signed URLs
-        service_account_path = os.getenv('FIREBASE_SERVICE_ACCOUNT_PATH')
-        
-        if service_account_path and os.path.exists(service_account_path):
-            # Load from mounted secret
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_path
-            )
-            self.gcs_client = gcs.Client(
-                credentials=credentials,
-                project='animation-padhaai-88646'
-            )
-            logger.info(f"✅ Loaded service account credentials from: {service_account_path}")
-        else:
-            # Fallback to default credentials (won't work for signed URLs)
-            self.gcs_client = gcs.Client()
-            logger.warning(f"⚠️ Service account file not found at: {service_account_path}")
-            logger.warning("⚠️ Using default credentials - signed URLs may not work")
+        self.url_ttl_seconds = url_ttl_seconds
+        self.url_cache = SignedUrlCache(
+            max_entries=cache_max_entries,
+            refresh_margin_seconds=cache_refresh_margin_seconds
+        )
     
     async def upload_video(self, video_path: str, chat_id: str) -> str:
         """
-        Upload video to Firebase Storage and return signed URL
+        Upload video to Firebase Storage and return the blob path.
+        Signed URLs are generated on demand via get_signed_url.
         """
         try:
             # Generate unique filename
@@ -60,27 +56,81 @@ class StorageService:
             
             logger.info(f"⬆️ Uploading video to: {filename}")
             
-            with open(video_path, 'rb') as video_file:
-                blob.upload_from_file(video_file, content_type='video/mp4')
+            # The client library blocks for the whole upload; keep it off the event loop
+            await asyncio.to_thread(blob.upload_from_filename, video_path, content_type='video/mp4')
             
             logger.info(f"✅ Video uploaded successfully: {filename}")
             
-            # Use GCS client with service account to generate signed URL
-            gcs_bucket = self.gcs_client.bucket(self.bucket_name)
-            gcs_blob = gcs_bucket.blob(filename)
+            return filename
+            
+        except Exception as e:
+            logger.error(f"❌ Error uploading video for {chat_id}: {str(e)}")
+            raise
+    
+    async def upload_previews(self, previews: dict, video_blob_path: str) -> dict:
+        """
+        Upload poster/thumbnail/sprite next to the video blob.
+        Returns {asset_name: blob_path}.
+        """
+        base = os.path.splitext(video_blob_path)[0]
+        blob_paths = {}
+        
+        try:
+            for name in ("poster", "thumbnail", "sprite"):
+                local_path = previews.get(name)
+                if not local_path:
+                    continue
+                
+                blob_path = f"{base}_{name}.jpg"
+                await asyncio.to_thread(
+                    self.bucket.blob(blob_path).upload_from_filename,
+                    local_path, content_type='image/jpeg'
+                )
+                blob_paths[name] = blob_path
+            
+            logger.info(f"✅ Uploaded previews for: {video_blob_path}")
+            return blob_paths
             
-            # Generate signed URL (valid for 7 days)
-            signed_url = gcs_blob.generate_signed_url(
+        except Exception as e:
+            logger.error(f"❌ Error uploading previews for {video_blob_path}: {str(e)}")
+            raise
+    
+    async def delete_blobs(self, blob_paths: list):
+        """
+        Remove uploaded blobs that will never be referenced (e.g. a cancelled job)
+        """
+        for blob_path in blob_paths:
+            try:
+                await asyncio.to_thread(self.bucket.blob(blob_path).delete)
+                logger.info(f"🗑️ Deleted orphaned blob: {blob_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ Could not delete blob {blob_path}: {str(e)}")
+    
+    async def get_signed_url(self, blob_path: str) -> Tuple[str, float]:
+        """
+        Return (signed_url, expires_at) for a stored blob.
+        Hot videos are served from the cache; entries are re-signed
+        before they expire.
+        """
+        cached = self.url_cache.get(blob_path)
+        if cached:
+            return cached
+        
+        try:
+            blob = self.bucket.blob(blob_path)
+            expires_at = time.time() + self.url_ttl_seconds
+            # Without a key file this is an IAM signBlob call, so run it in a thread
+            signed_url = await asyncio.to_thread(
+                blob.generate_signed_url,
                 version="v4",
-                expiration=timedelta(days=7),
+                expiration=timedelta(seconds=self.url_ttl_seconds),
                 method="GET"
             )
             
-            logger.info(f"🔐 Generated signed URL for: {filename}")
-            logger.info(f"🔗 URL expires in 7 days")
-            
-            return signed_url
+            self.url_cache.put(blob_path, signed_url, expires_at)
+            logger.info(f"🔐 Generated signed URL for: {blob_path}")
+            return signed_url, expires_at
             
         except Exception as e:
-            logger.error(f"❌ Error uploading video for {chat_id}: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error(f"❌ Error signing URL for {blob_path}: {str(e)}")
+            raise
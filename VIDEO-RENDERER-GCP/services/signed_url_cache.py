@@ -0,0 +1,70 @@
+# ===============================
+# services/signed_url_cache.py
+# LRU + TTL cache for on-demand signed URLs
+# ===============================
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SignedUrlCache:
+    def __init__(self, max_entries: int = 1024, refresh_margin_seconds: int = 3600):
+        """
+        Keep recently signed URLs keyed by blob path.
+        An entry is treated as stale once it is within refresh_margin_seconds
+        of expiring, so callers never hand out a link that is about to die.
+        """
+        self.max_entries = max_entries
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, blob_path: str) -> Optional[Tuple[str, float]]:
+        """
+        Return (url, expires_at) if a fresh entry exists, otherwise None
+        """
+        with self._lock:
+            entry = self._entries.get(blob_path)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            url, expires_at = entry
+            if expires_at - time.time() <= self.refresh_margin_seconds:
+                # Close to expiry - drop it so the caller re-signs
+                del self._entries[blob_path]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(blob_path)
+            self.hits += 1
+            return entry
+
+    def put(self, blob_path: str, url: str, expires_at: float):
+        """
+        Store a signed URL, evicting the least recently used entry when full
+        """
+        with self._lock:
+            self._entries[blob_path] = (url, expires_at)
+            self._entries.move_to_end(blob_path)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug(f"Evicted signed URL for: {evicted}")
+
+    def invalidate(self, blob_path: str):
+        with self._lock:
+            self._entries.pop(blob_path, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
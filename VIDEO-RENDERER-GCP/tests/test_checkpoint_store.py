@@ -0,0 +1,81 @@
+# ===============================
+# tests/test_checkpoint_store.py
+# Segment bookkeeping and claims of render checkpoints
+# ===============================
+import os
+import json
+import time
+
+from services.checkpoint_store import CheckpointStore
+
+
+def make_segments(directory, indexes):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in indexes:
+        path = os.path.join(directory, f"uncached_{index:05d}.mp4")
+        with open(path, 'wb') as f:
+            f.write(b"segment")
+        paths.append(path)
+    return paths
+
+
+def test_segments_keep_contiguous_run_from_zero(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    partials = make_segments(str(tmp_path / "partials"), [0, 1, 3])
+
+    completed = store.save("chat-1", {"userId": "user-1", "manim_code": "code"}, partials)
+
+    assert completed == 2
+    assert [os.path.basename(p) for p in store.segments("chat-1")] == ["uncached_00000.mp4", "uncached_00001.mp4"]
+    state = store.load("chat-1")
+    assert state["completed_animations"] == 2
+    assert state["manim_code"] == "code"
+
+
+def test_segments_empty_without_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    assert store.segments("missing") == []
+    assert store.load("missing") is None
+
+
+def test_claim_is_exclusive_until_released(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save("chat-1", {"userId": "user-1"}, [])
+    assert store.list_resumable() == ["chat-1"]
+
+    assert store.claim("chat-1", "instance-a")
+    assert not store.claim("chat-1", "instance-b")
+    assert store.list_resumable() == []
+
+    # Only the owner can release
+    store.release("chat-1", "instance-b")
+    assert not store.claim("chat-1", "instance-b")
+
+    store.release("chat-1", "instance-a")
+    assert store.list_resumable() == ["chat-1"]
+    assert store.claim("chat-1", "instance-b")
+
+
+def test_claim_without_checkpoint_fails(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    assert not store.claim("missing", "instance-a")
+
+
+def test_expired_claim_is_taken_over(tmp_path):
+    store = CheckpointStore(str(tmp_path), claim_ttl_seconds=60)
+    store.save("chat-1", {"userId": "user-1"}, [])
+    assert store.claim("chat-1", "killed-instance")
+    assert not store.claim("chat-1", "instance-b")
+
+    # Age the claim past its TTL, as if its owner was killed an hour ago
+    with open(os.path.join(str(tmp_path), "chat-1", "claim"), 'w') as f:
+        json.dump({"owner": "killed-instance", "claimedAt": time.time() - 3600}, f)
+
+    assert store.list_resumable() == ["chat-1"]
+    assert store.claim("chat-1", "instance-b")
+    assert store.list_resumable() == []
+
+    # The killed instance's late release must not free the new claim
+    store.release("chat-1", "killed-instance")
+    assert not store.claim("chat-1", "instance-c")
@@ -0,0 +1,157 @@
+# ===============================
+# tests/test_job_queue.py
+# Lease expiry, re-claim and give-up behaviour of the render job queue
+# ===============================
+import time
+import asyncio
+
+from services.job_queue import LocalJobQueue, LEASED, QUEUED, DONE, FAILED
+from services.queue_worker import QueueWorker
+
+
+class RecordingFirestoreService:
+    def __init__(self):
+        self.statuses = []
+
+    async def update_render_status(self, userId, chatId, status, message):
+        self.statuses.append((userId, chatId, status))
+
+
+def test_expired_lease_is_reclaimed_by_another_worker():
+    async def scenario():
+        queue = LocalJobQueue()
+        await queue.enqueue("user-1", "chat-1")
+
+        first = await queue.claim("worker-a", lease_seconds=0.05)
+        assert first["leaseOwner"] == "worker-a"
+        assert first["attempts"] == 1
+
+        # Live lease: nobody else can take it
+        assert await queue.claim("worker-b", lease_seconds=60) is None
+
+        await asyncio.sleep(0.1)
+        second = await queue.claim("worker-b", lease_seconds=60)
+        assert second["chatId"] == "chat-1"
+        assert second["leaseOwner"] == "worker-b"
+        assert second["attempts"] == 2
+
+        # The old owner can no longer extend or finish the job
+        assert not await queue.heartbeat("chat-1", "worker-a", 60)
+        assert not await queue.complete("chat-1", "worker-a")
+        assert await queue.complete("chat-1", "worker-b")
+        assert queue.jobs["chat-1"]["state"] == DONE
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_keeps_lease_alive():
+    async def scenario():
+        queue = LocalJobQueue()
+        await queue.enqueue("user-1", "chat-1")
+        await queue.claim("worker-a", lease_seconds=0.1)
+
+        for _ in range(3):
+            await asyncio.sleep(0.05)
+            assert await queue.heartbeat("chat-1", "worker-a", 0.1)
+            assert await queue.claim("worker-b", lease_seconds=60) is None
+
+        assert queue.jobs["chat-1"]["state"] == LEASED
+
+    asyncio.run(scenario())
+
+
+def test_release_requeues_immediately():
+    async def scenario():
+        queue = LocalJobQueue()
+        await queue.enqueue("user-1", "chat-1")
+        await queue.claim("worker-a", lease_seconds=60)
+
+        assert await queue.release("chat-1", "worker-a")
+        assert queue.jobs["chat-1"]["state"] == QUEUED
+        job = await queue.claim("worker-b", lease_seconds=60)
+        assert job["leaseOwner"] == "worker-b"
+
+    asyncio.run(scenario())
+
+
+def test_job_out_of_attempts_is_marked_failed():
+    async def scenario():
+        firestore_service = RecordingFirestoreService()
+        queue = LocalJobQueue(max_attempts=2, firestore_service=firestore_service)
+        await queue.enqueue("user-1", "chat-1")
+
+        for worker in ("worker-a", "worker-b"):
+            assert await queue.claim(worker, lease_seconds=0.01)
+            await asyncio.sleep(0.02)
+
+        assert await queue.claim("worker-c", lease_seconds=60) is None
+        assert queue.jobs["chat-1"]["state"] == FAILED
+        assert firestore_service.statuses == [("user-1", "chat-1", "failed")]
+
+    asyncio.run(scenario())
+
+
+class SlowWebhookHandler:
+    """Renders until cancelled, like a long Manim job"""
+    def __init__(self):
+        self.draining = False
+        self.cancelled = []
+        self._cancel = asyncio.Event()
+
+    async def process_render_request(self, userId, chatId, traceId=None, from_queue=False):
+        try:
+            await asyncio.wait_for(self._cancel.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            return "completed"
+        return "cancelled"
+
+    async def cancel(self, chatId):
+        self.cancelled.append(chatId)
+        self._cancel.set()
+
+
+def test_worker_cancels_job_when_lease_is_lost():
+    async def scenario():
+        queue = LocalJobQueue()
+        await queue.enqueue("user-1", "chat-1")
+        handler = SlowWebhookHandler()
+        worker = QueueWorker(queue, handler, "worker-a", lease_seconds=0.1, heartbeat_interval=0.05)
+
+        job = await queue.claim("worker-a", lease_seconds=0.1)
+        # Another worker takes the job over while worker-a is still rendering
+        queue.jobs["chat-1"].update(leaseOwner="worker-b")
+
+        await worker._slots.acquire()
+        start = time.time()
+        await worker._process(job)
+
+        assert handler.cancelled == ["chat-1"]
+        assert time.time() - start < 1
+        assert worker.counts["lease_lost"] == 1
+        assert queue.jobs["chat-1"]["leaseOwner"] == "worker-b"
+
+    asyncio.run(scenario())
+
+
+def test_worker_stops_claiming_once_draining():
+    async def scenario():
+        queue = LocalJobQueue()
+        for n in range(3):
+            await queue.enqueue("user-1", f"chat-{n}")
+        handler = SlowWebhookHandler()
+        worker = QueueWorker(queue, handler, "worker-a", lease_seconds=60, max_in_flight=1)
+
+        run = asyncio.create_task(worker.run())
+        await asyncio.sleep(0.05)
+        # One job in flight, the loop is waiting for its slot
+        assert worker.counts["claimed"] == 1
+
+        handler.draining = True
+        worker.stop()
+        await handler.cancel("chat-0")
+        await asyncio.wait_for(run, timeout=1)
+
+        assert worker.counts["claimed"] == 1
+        assert [job["state"] for job in queue.jobs.values()].count(QUEUED) == 2
+
+    asyncio.run(scenario())
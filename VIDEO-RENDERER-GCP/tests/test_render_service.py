@@ -0,0 +1,147 @@
+# ===============================
+# tests/test_render_service.py
+# Checkpoint handling of the render pipeline around drain and resume
+# ===============================
+import os
+import asyncio
+
+from services.checkpoint_store import CheckpointStore
+from services.render_service import WebhookHandler
+
+
+class MemoryFirestoreService:
+    """finalAnswers documents held in memory, with the service's status rules"""
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def get_manim_code(self, userId, chatId):
+        return self.docs[chatId]["answer"]
+
+    async def update_render_status(self, userId, chatId, status, message=""):
+        self.docs[chatId].update(renderStatus=status, renderMessage=message)
+
+    async def update_render_status_if_pending(self, userId, chatId, status, message=""):
+        doc = self.docs.get(chatId)
+        if not doc or doc["ownerId"] != userId or doc.get("renderStatus") == "completed":
+            return False
+        doc.update(renderStatus=status, renderMessage=message)
+        return True
+
+    async def update_render_complete(self, userId, chatId, video_path, previews=None):
+        self.docs[chatId].update(renderStatus="completed", videoPath=video_path)
+        return True
+
+
+class MemoryStorageService:
+    def __init__(self):
+        self.uploaded = []
+
+    async def upload_video(self, video_path, chat_id):
+        self.uploaded.append(chat_id)
+        return f"rendered_videos/{chat_id}.mp4"
+
+    async def delete_blobs(self, blob_paths):
+        pass
+
+
+class TempFileManager:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_temp_directory(self):
+        return self.directory
+
+
+class GatedRenderer:
+    """Renders once `finish` is set; terminate() arrives too late to stop it"""
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.started = asyncio.Event()
+        self.finish = asyncio.Event()
+        self.last_backend = "cairo"
+        self.renders = 0
+
+    async def render_video(self, python_file_path, scene_name, manim_code, start_animation=0):
+        self.renders += 1
+        self.started.set()
+        await self.finish.wait()
+        path = os.path.join(self.work_dir, "out.mp4")
+        with open(path, 'wb') as f:
+            f.write(b"video")
+        return path
+
+    def completed_segments(self):
+        return []
+
+    async def terminate(self, timeout=5.0):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+def make_handler(tmp_path, docs):
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    renderer = GatedRenderer(str(tmp_path))
+    handler = WebhookHandler(
+        MemoryFirestoreService(docs), renderer, MemoryStorageService(),
+        TempFileManager(str(tmp_path)), checkpoint_store=store, instance_id="instance-a"
+    )
+    return handler, store, renderer
+
+
+def test_render_finishing_after_drain_removes_its_checkpoint(tmp_path):
+    async def scenario():
+        docs = {"chat-1": {"ownerId": "user-1", "answer": "code"}}
+        handler, store, renderer = make_handler(tmp_path, docs)
+
+        task = asyncio.create_task(handler.process_render_request("user-1", "chat-1"))
+        await renderer.started.wait()
+
+        await handler.drain()
+        assert docs["chat-1"]["renderStatus"] == "resumable"
+        # Held by this instance while the render may still finish here
+        assert store.list_resumable() == []
+
+        # Manim completes before it can be terminated
+        renderer.finish.set()
+        assert await task == "completed"
+
+        assert docs["chat-1"]["renderStatus"] == "completed"
+        assert store.load("chat-1") is None
+        assert store.list_resumable() == []
+        await handler.pipeline.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stale_checkpoint_of_completed_render_is_skipped(tmp_path):
+    async def scenario():
+        docs = {"chat-1": {"ownerId": "user-1", "answer": "code", "renderStatus": "completed", "videoPath": "v.mp4"}}
+        handler, store, renderer = make_handler(tmp_path, docs)
+        store.save("chat-1", {"userId": "user-1", "chatId": "chat-1", "manim_code": "code"}, [])
+
+        assert await handler.resume_next() == "chat-1"
+
+        assert renderer.renders == 0
+        assert docs["chat-1"]["renderStatus"] == "completed"
+        assert store.load("chat-1") is None
+        await handler.pipeline.stop()
+
+    asyncio.run(scenario())
+
+
+def test_job_handed_back_to_queue_is_not_marked_failed(tmp_path):
+    async def scenario():
+        docs = {"chat-1": {"ownerId": "user-1", "answer": "code", "renderStatus": "pending"}}
+        handler, store, renderer = make_handler(tmp_path, docs)
+        handler.draining = True
+
+        assert await handler.process_render_request("user-1", "chat-1", from_queue=True) == "resumable"
+        assert docs["chat-1"]["renderStatus"] == "queued"
+
+        assert await handler.process_render_request("user-1", "chat-1") == "failed"
+        assert docs["chat-1"]["renderStatus"] == "failed"
+        await handler.pipeline.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+# ===============================
+# tests/test_renderer_policy.py
+# Static scene analysis behind the Cairo/OpenGL choice
+# ===============================
+from services.renderer_policy import CAIRO, OPENGL, analyze_scene, choose_renderer, _estimate_objects
+
+
+def test_simple_2d_scene_uses_cairo():
+    code = """
+class MainScene(Scene):
+    def construct(self):
+        circle = Circle()
+        self.play(Create(circle))
+"""
+    assert choose_renderer(code) == (CAIRO, "simple 2D scene")
+
+
+def test_3d_scene_uses_opengl():
+    code = """
+class MainScene(ThreeDScene):
+    def construct(self):
+        self.set_camera_orientation(phi=75 * DEGREES)
+        self.play(Create(Sphere()))
+"""
+    renderer, reason = choose_renderer(code)
+    assert renderer == OPENGL
+    assert reason == "3D scene"
+
+
+def test_opengl_incompatible_features_force_cairo():
+    code = """
+class MainScene(VoiceoverScene, ThreeDScene):
+    def construct(self):
+        self.add(Sphere())
+"""
+    renderer, reason = choose_renderer(code)
+    assert renderer == CAIRO
+    assert "VoiceoverScene" in reason
+    assert analyze_scene(code)["opengl_incompatible"] == ["VoiceoverScene"]
+
+
+def test_many_mobjects_use_opengl():
+    code = """
+class MainScene(Scene):
+    def construct(self):
+        for i in range(20):
+            for j in range(10):
+                self.add(Dot())
+"""
+    assert _estimate_objects(code) == 200
+    assert choose_renderer(code) == (OPENGL, "~200 mobjects")
+    assert choose_renderer(code, object_threshold=500)[0] == CAIRO
+
+
+def test_object_estimate_multiplies_literal_loops_only():
+    code = """
+dots = [Dot() for _ in range(5)]
+for i in range(2, 10, 2):
+    Square()
+for item in items:
+    Circle()
+"""
+    # 5 dots + 4 squares + 1 circle (loop length unknown)
+    assert _estimate_objects(code) == 10
+
+
+def test_object_estimate_survives_syntax_errors():
+    assert _estimate_objects("Circle( Square( Dot(") == 3